@@ -122,6 +122,7 @@ class BgpNeighbor:
     def __init__(self, addr, import_policy=None, export_policy=None):
         self._addr = addr
         self._iface = None
+        self._connected_vlan = None
         self._bgp = None
         self._import_policy = import_policy
         self._export_policy = export_policy
@@ -145,6 +146,14 @@ class BgpNeighbor:
     def iface(self):
         return self._iface
 
+    @property
+    def connected_vlan(self):
+        """
+        The local VLAN through which the neighbor is reachable via a connected
+        route, or None if the neighbor is only reachable via an IGP
+        """
+        return self._connected_vlan
+
     @property
     def bgp(self):
         return self._bgp
@@ -255,6 +264,15 @@ class Router:
             self._bgp._router = self
         self._subnets = subnets
 
+        # Index connected networks by (version, prefix length) and then by
+        # network address; the first VLAN with a network wins
+        self._connected = {}
+        for order, vlan in enumerate(self._vlans.values()):
+            network = vlan.addr.network
+            table = self._connected.setdefault(
+                    (network.version, network.prefixlen), {})
+            table.setdefault(int(network.network_address), (order, vlan))
+
     @classmethod
     def create(cls, router_json):
         name = router_json["name"]
@@ -312,6 +330,21 @@ class Router:
     def subnets(self):
         return self._subnets
 
+    def connected_vlan(self, addr):
+        """
+        Get the first of the router's VLANs whose network contains addr, or
+        None if addr is not in a connected network
+        """
+        match = None
+        for (version, prefixlen), table in self._connected.items():
+            if (version != addr.version):
+                continue
+            hostbits = addr.max_prefixlen - prefixlen
+            entry = table.get((int(addr) >> hostbits) << hostbits)
+            if (entry is not None and (match is None or entry[0] < match[0])):
+                match = entry
+        return (None if match is None else match[1])
+
     def __str__(self):
         result = "Router %s:\n" % self._name
         result += ("\tVlans:\n%s\n" % 
@@ -332,7 +365,8 @@ class Path:
     def __init__(self, origin, endpoint, failset, exists, expected):
         self._origin = origin
         self._endpoint = endpoint
-        self._failset = failset
+        self._failset_json = failset
+        self._failset = frozenset(Path.link(*pair) for pair in failset) - {None}
         self._exists = exists
         self._expected = expected
 
@@ -343,6 +377,16 @@ class Path:
                 path_json["exists"],
                 (path_json["expected"] if "expected" in path_json else []))
 
+    @staticmethod
+    def link(router_a, router_b):
+        """
+        Identifier for the physical link(s) between two routers; None if both
+        ends are the same router
+        """
+        if (router_a == router_b):
+            return None
+        return (min(router_a, router_b), max(router_a, router_b))
+
     @property
     def origin(self):
         return self._origin
@@ -365,7 +409,7 @@ class Path:
 
     def __str__(self):
         return ("Path <origin=%s, endpoint=%s, failset=%s, exists=%s, expected=[%s]>" % 
-                (self._origin, self._endpoint, self._failset, self._exists, 
+                (self._origin, self._endpoint, self._failset_json, self._exists, 
                 ','.join(self._expected)))
 
 class Network:
@@ -373,6 +417,12 @@ class Network:
         self._routers = routers
         self._paths = paths
 
+        # Index VLANs by address; the first VLAN with an address wins
+        self._vlan_addrs = {}
+        for router in self._routers.values():
+            for vlan in router.vlans.values():
+                self._vlan_addrs.setdefault(vlan.addr.ip, vlan)
+
         # Link interfaces and BGP neighbors
         for router in self._routers.values():
             for iface in router.ifaces.values():
@@ -381,12 +431,30 @@ class Network:
                 for neighbor in router.bgp.neighbors:
                     self._update_bgp_neighbor_iface(neighbor)
 
-    def _update_bgp_neighbor_iface(self, neighbor):
+        # Identify physical links
+        self._links = sorted(set([Path.link(router.name, 
+                iface.neighbor.router.name) for router in self._routers.values()
+                for iface in router.ifaces.values()]) - {None})
+
+        # Assign a bit position to every route tag used in a policy
+        self._tags = []
+        self._tag_bits = {}
         for router in self._routers.values():
-            for vlan in router.vlans.values():
-                if neighbor.addr == vlan.addr.ip:
-                    neighbor._iface = vlan
-                    return
+            if router.bgp is None:
+                continue
+            for neighbor in router.bgp.neighbors:
+                for policy in [neighbor.import_policy, neighbor.export_policy]:
+                    if policy is None:
+                        continue
+                    for key in ['at', 'rt', 'bt']:
+                        self.tag_mask(policy.get(key, []))
+
+    def _update_bgp_neighbor_iface(self, neighbor):
+        vlan = self.vlan_with_addr(neighbor.addr)
+        if vlan is not None:
+            neighbor._iface = vlan
+        neighbor._connected_vlan = neighbor.bgp.router.connected_vlan(
+                neighbor.addr)
 
     @classmethod
     def load(cls, json_path):
@@ -418,6 +486,34 @@ class Network:
     def paths(self):
         return self._paths
 
+    @property
+    def links(self):
+        return self._links
+
+    @property
+    def vlan_addrs(self):
+        return self._vlan_addrs
+
+    def vlan_with_addr(self, addr):
+        return self._vlan_addrs.get(addr)
+
+    @property
+    def tags(self):
+        return self._tags
+
+    def tag_mask(self, tags):
+        mask = 0
+        for tag in tags:
+            tag = str(tag)
+            if tag not in self._tag_bits:
+                self._tag_bits[tag] = len(self._tags)
+                self._tags.append(tag)
+            mask |= (1 << self._tag_bits[tag])
+        return mask
+
+    def tag_names(self, mask):
+        return [tag for bit, tag in enumerate(self._tags) if (mask >> bit) & 1]
+
 
     def __str__(self):
         return '\n'.join([str(self._routers[n]) 
@@ -2,11 +2,15 @@
 
 from argparse import ArgumentParser
 import config
+import contextlib
 import graph
+import io
+import itertools
+import multiprocessing
 import nsdi
-import os
 import prensdi
 import redesign
+import render
 
 def simplify_path(path):
     simple = [path[0]]
@@ -19,182 +23,481 @@ def simplify_path(path):
             simple += [router]
     return simple 
 
-def check_paths(net, graphs, verbose=False, reprocess=False):
+def check_paths(net, graphs, verbose=False, reprocess=False, worklist=False,
+        dijkstra=False):
     for p in net.paths:
-        g = graphs[(p.origin, p.endpoint)]
-        print("%s" % (p))
-        found, hops = g.has_path(p.failset)
-        if (found):
-            print("\tDFS path exists")
-#        if (found):
-        bestpath, bestsign = g.tpvp(verbose, p.failset, reprocess)
-        if (bestpath is not None):
-            print('\t'+str(bestsign))
-            print('\t'+'\n\t'.join(bestpath))
-            if (simplify_path(bestpath) != p.expected):
-                print("ERROR: path should be [%s] but is [%s]" %
-                        ('>'.join(p.expected), 
-                        '>'.join(simplify_path(bestpath))))
-        else:
-            print('\tNo path')
-            if (p.exists):
-                print("ERROR: path should exist but doesn't exist")
-#        else:
-#            print('\tNo path')
-#            if (p.exists):
-#                print("ERROR: path should exist but doesn't exist")
+        check_path(p, graphs[(p.origin, p.endpoint)], verbose, reprocess,
+                worklist, dijkstra)
 
-def main():
-    # Parse arguments
-    arg_parser = ArgumentParser(description='Tiramisu prototype')
-    arg_parser.add_argument('-json', dest='json_path', action='store',
-            required=True, help='Path to network json')
-    arg_parser.add_argument('-render', dest='render_path', action='store',
-            required=True, help='Path to render graphs')
-    arg_parser.add_argument('-rules', dest='rules', action='store',
-            help='Rules to follow', required=True,
-            choices=["nsdi", "prensdi", "nsditpg", "prensdimod", "nsdimod", 
-                "redesign"])
-    arg_parser.add_argument('-paths', dest='paths', action='store_true',
-            help='Check paths')
-    arg_parser.add_argument('-verbose', dest='verbose', action='store_true',
-            help='Verbose output')
-    arg_parser.add_argument('-contract', dest='contract', action='store_true',
-            help='Conduct edge-contraction on TPG')
-    settings = arg_parser.parse_args()
-    print("Settings: %s" % settings)
+def check_path(p, g, verbose=False, reprocess=False, worklist=False,
+        dijkstra=False):
+    print("%s" % (p))
+    found, hops = g.has_path(p.failset, p.endpoint)
+    if (found):
+        print("\tDFS path exists")
+#    if (found):
+    bestpath, bestsign = g.tpvp(verbose, p.failset, reprocess, worklist,
+            dijkstra, p.endpoint)
+    if (bestpath is not None):
+        print('\t'+g.sign_str(bestsign))
+        print('\t'+'\n\t'.join(bestpath))
+        if (simplify_path(bestpath) != p.expected):
+            print("ERROR: path should be [%s] but is [%s]" %
+                    ('>'.join(p.expected), 
+                    '>'.join(simplify_path(bestpath))))
+    else:
+        print('\tNo path')
+        if (p.exists):
+            print("ERROR: path should exist but doesn't exist")
+#    else:
+#        print('\tNo path')
+#        if (p.exists):
+#            print("ERROR: path should exist but doesn't exist")
 
-    net = config.Network.load(settings.json_path)
-#    print(net)
+def path_links(g, path):
+    links = set([g.link_id(src, dst) for src, dst in zip(path, path[1:])])
+    links.discard(None)
+    return links
 
-    # Generate physical and layer 2
-    phy = graph.Physical(net)
-    phy.render(os.path.join(settings.render_path, 'physical.png'))
-    l2 = graph.Layer2(net)
-    l2.render(os.path.join(settings.render_path, 'layer2.png'))
-    ospf = graph.Ospf(net, l2)
-    ospf.render(os.path.join(settings.render_path, 'ospf.png'))
-    bgp = graph.Bgp(net)
-    bgp.render(os.path.join(settings.render_path, 'bgp.png'))
-    combined = graph.Combined(net, l2)
-    combined.render(os.path.join(settings.render_path, 'combined.png'))
+def scenario_str(failed):
+    return ','.join(['-'.join(link) for link in sorted(failed)])
 
+def check_failures(net, graphs, k, verbose=False, reprocess=False, 
+        worklist=False, dijkstra=False):
+    for p in net.paths:
+        check_failure(net, p, graphs[(p.origin, p.endpoint)], k, verbose,
+                reprocess, worklist, dijkstra)
 
-    # Determine subnets
-    subnets = set()
-    for router in net.routers.values():
-        subnets.update(router.subnets)
+def check_failure(net, p, g, k, verbose=False, reprocess=False, 
+        worklist=False, dijkstra=False):
+    """
+    Check a path under all combinations of up to k link failures (in
+    addition to the path's own failset), and report the combinations that
+    disconnect the origin from the endpoint or change the best path.
+    Disconnections are reported as minimal cuts; the combinations that
+    contain a cut are only counted (and listed if verbose).
+    """
+    print("%s" % (p))
+    basefound, hops = g.has_path(p.failset, p.endpoint)
+    if (not basefound):
+        print("\tNo path without failures")
+        return
+    basepath, _ = g.tpvp(False, p.failset, reprocess, worklist, dijkstra,
+            p.endpoint)
+
+    # Failures of links the DFS path does not traverse cannot disconnect the
+    # origin from the endpoint, and failing more links than a cut cannot
+    # connect them. Failures of links outside the core (see
+    # graph.TPG.core_links) cannot change the best path, so they are pruned.
+    # When reprocessing, the best path is stitched from several vertices'
+    # best paths, and without a best path a failure may let TPVP find one,
+    # so TPVP is always rerun.
+    dfs_links = path_links(g, hops)
+    core = None
+    if (basepath is not None and not reprocess):
+        core = g.core_links(p.failset, p.endpoint)
 
-    graphs = None
+    links = [link for link in net.links if link not in p.failset]
+    cuts = set()
+    implied = 0
+    unrouted = 0
+    scenarios = 0
+    pruned = 0
+    changed = 0
+    for size in range(1, k+1):
+        for failed in itertools.combinations(links, size):
+            scenarios += 1
+
+            # Combinations are enumerated by size, so every cut found so far
+            # is minimal, and a combination contains one if one of its
+            # subsets is a cut
+            cut = next((c for n in range(1, size) for c in map(frozenset, 
+                    itertools.combinations(failed, n)) if c in cuts), None)
+            failed = frozenset(failed)
+            if (cut is not None):
+                implied += 1
+                if (verbose):
+                    print("\tDisconnected by [%s] (contains [%s])" % 
+                            (scenario_str(failed), scenario_str(cut)))
+                continue
+            if (core is not None and core.isdisjoint(failed)):
+                pruned += 1
+                continue
+
+            failset = p.failset | failed
+            if (dfs_links.isdisjoint(failed)):
+                found = True
+            else:
+                found, _ = g.has_path(failset, p.endpoint)
+            if (found):
+                bestpath, _ = g.tpvp(False, failset, reprocess, worklist,
+                        dijkstra, p.endpoint)
+            else:
+                bestpath = None
+                cuts.add(failed)
+
+            scenario = scenario_str(failed)
+            if (not found or (bestpath is None and basepath is not None)):
+                if (found):
+                    unrouted += 1
+                print("\tDisconnected by [%s]" % scenario)
+            elif (bestpath != basepath):
+                changed += 1
+                print("\tChanged by [%s]: %s" % (scenario, 
+                        '>'.join(simplify_path(bestpath))))
+            elif (verbose):
+                print("\tUnchanged by [%s]" % scenario)
+
+    disconnects = len(cuts) + implied + unrouted
+    print("\t%d scenarios: %d pruned, %d disconnect (%d minimal cuts, "
+            "%d containing a cut, %d without a best path), %d change path" %
+            (scenarios, pruned, disconnects, len(cuts), implied, unrouted,
+                changed))
+    if (disconnects > 0):
+        print("\tNot resilient to %d link failures" % k)
+    else:
+        print("\tResilient to %d link failures" % k)
+
+def build_rag(net, l2, subnets, settings):
+    """
+    Build and taint the RAG shared by the graphs for all of the given
+    destinations, or return None if the rules do not use a RAG
+    """
+    if (settings.rules.startswith("nsdi")):
+        rag = nsdi.RAG(net, l2, subnets)
+    elif (settings.rules.startswith("redesign")):
+        rag = redesign.RAG(net, l2, subnets)
+    else:
+        return None
+    rag.taint(settings.verbose)
+    return rag
+
+def build_graphs(net, l2, rag, t, sources, settings, renderer, igp=None):
+    """
+    Build (and render) the graphs for destination t and each of the given
+    sources, and return them keyed by (t, s). TPGs built from a RAG are
+    shared by all pairs with destination t, so TPVP is solved once per
+    destination. Redesign TPGs reach next hops through the shared IGP layer
+    igp, if given.
+    """
+    graphs = {}
+    if (rag is not None and renderer.wants('rag')):
+        renderer.render(rag.view(t), 'rag', 'rag_%s.png' % t)
 
     # Create NSDI-style graphs
     if (settings.rules.startswith("nsdi")):
-        # Create RAGs
-        rags = {} 
-        for t in subnets:
-            rag = nsdi.RAG(net, l2, t)
-            rag.taint(settings.verbose)
-            rag.render(os.path.join(settings.render_path, ('rag_%s.png' % t)))
-            rags[t] = rag
 
         if (settings.rules == "nsdi"):
             # Create RPGs
-            rpgs = {}
-            for t in subnets:
-                for s in subnets:
-                    if (s == t):
-                        continue
-                    pair = (t, s)
-                    rpg = nsdi.RPG(net, pair, rags[t])
-                    rpg.render(os.path.join(settings.render_path, 
-                        ('rpg_%s-%s.png') % pair))
-                    rpgs[pair] = rpg
-
-            graphs = rpgs
+            for s in sources:
+                pair = (t, s)
+                rpg = nsdi.RPG(net, pair, rag)
+                renderer.render(rpg, 'rpg', 'rpg_%s-%s.png' % pair)
+                graphs[pair] = rpg
         else:
-            # Create TPGs
-            tpgs = {}
-            for t in subnets:
-                for s in subnets:
-                    if (s == t):
-                        continue
-                    pair = (t, s)
-                    if (settings.rules == "nsdimod"):
-                        tpg = nsdi.TPGMod(net, pair, rags[t])
-                    else:
-                        tpg = nsdi.TPG(net, pair, rags[t])
-                    tpg.render(os.path.join(settings.render_path, 
-                        ('tpg_%s-%s.png') % pair))
-                    tpgs[pair] = tpg
-
-            graphs = tpgs
-
+            # Create TPG
+            if (settings.rules == "nsdimod"):
+                tpg = nsdi.TPGMod(net, (t, sources), rag)
+            else:
+                tpg = nsdi.TPG(net, (t, sources), rag)
+            renderer.render(tpg, 'tpg', 'tpg_%s.png' % tpg.name)
+            for s in sources:
+                graphs[(t, s)] = tpg
 
     # Create pre-NSDI-style graphs
     elif (settings.rules.startswith("prensdi")):
-        # Create RPGs
-        rpgs = {}
-        for t in subnets:
-            for s in subnets:
-                if (s == t):
-                    continue
-                pair = (t, s)
-                if (settings.rules == "prensdimod"):
-                    rpg = prensdi.RPGMod(net, l2, pair)
-                else:
-                    rpg = prensdi.RPG(net, l2, pair)
-                rpg.taint()
-                rpg.render(os.path.join(settings.render_path, 
-                    ('rpg_%s-%s.png') % pair))
-                rpgs[pair] = rpg
-
-        # Create RPGs
-        tpgs = {}
-        for pair,rpg in rpgs.items():
+        # RPGs are tainted from the source, so graphs are built per pair
+        for s in sources:
+            pair = (t, s)
+
+            # Create RPG
+            if (settings.rules == "prensdimod"):
+                rpg = prensdi.RPGMod(net, l2, pair)
+            else:
+                rpg = prensdi.RPG(net, l2, pair)
+            rpg.taint()
+            renderer.render(rpg, 'rpg', 'rpg_%s-%s.png' % pair)
+
+            # Create TPG
             if (settings.rules == "prensdimod"):
                 tpg = prensdi.TPGMod(net, rpg, pair)
             else:
                 tpg = prensdi.TPG(net, rpg, pair)
-            tpg.render(os.path.join(settings.render_path, 
-                ('tpg_%s-%s.png') % pair))
-            tpgs[pair] = tpg
-
-        graphs = tpgs
+            renderer.render(tpg, 'tpg', 'tpg_%s.png' % tpg.name)
+            graphs[pair] = tpg
 
     # Create redesign-style graphs
     elif (settings.rules.startswith("redesign")):
-        # Create RAGs
-        rags = {} 
-        for t in subnets:
-            rag = redesign.RAG(net, l2, t)
-            rag.taint(settings.verbose)
-            rag.render(os.path.join(settings.render_path, ('rag_%s.png' % t)))
-            rags[t] = rag
-
-        # Create TPGs
-        tpgs = {}
-        for t in subnets:
-            for s in subnets:
-                if (s == t):
-                    continue
-                pair = (t, s)
-                tpg = redesign.TPG(net, pair, rags[t])
-                tpg.render(os.path.join(settings.render_path, 
-                    ('tpg_%s-%s.png') % pair))
-                tpgs[pair] = tpg
+        # Create TPG
+        tpg = redesign.TPG(net, (t, sources), rag, igp)
+        renderer.render(tpg, 'tpg', 'tpg_%s.png' % tpg.name)
+        for s in sources:
+            graphs[(t, s)] = tpg
 
-        graphs = tpgs
+    return graphs
 
-    if settings.paths and graphs is not None:
+def contract_graphs(graphs, renderer):
+    contracted = []
+    for g in graphs.values():
+        # Several pairs may share a TPG, and only TPGs are contracted
+        if (g in contracted or not isinstance(g, graph.TPG)):
+            continue
+        contracted.append(g)
+        print("TPG %s" % g.name)
+        g.contract()
+        renderer.render(g, 'contract', 'tpg-contract_%s.png' % g.name)
+
+class GraphRegistry:
+    """
+    Graphs for a set of (t, s) pairs, keyed by pair. The graphs for a
+    destination are built (see build_graphs), and contracted if requested,
+    the first time one of its pairs is looked up, and only for the sources
+    of the registered pairs; graphs for destinations that are never looked
+    up are never built. The RAG for all destinations is built (and tainted)
+    once, up front, and the IGP layer (and its table of paths) traversed by
+    redesign TPGs is shared by all destinations.
+    """
+    def __init__(self, net, l2, pairs, settings, renderer):
+        self._net = net
+        self._l2 = l2
+        self._settings = settings
+        self._renderer = renderer
+        self._sources = {}
+        for t, s in sorted(set(pairs)):
+            self._sources.setdefault(t, []).append(s)
+        self._graphs = {}
+        self._rag = None
+        if (len(self._sources) > 0):
+            self._rag = build_rag(net, l2, self.destinations, settings)
+        self._igp = None
+        if (settings.rules.startswith("redesign")):
+            self._igp = redesign.IgpLayer(net)
+
+    @property
+    def destinations(self):
+        return list(self._sources.keys())
+
+    def build(self, t):
+        if (t not in self._graphs):
+            self._graphs[t] = build_graphs(self._net, self._l2, self._rag,
+                    t, self._sources[t], self._settings, self._renderer,
+                    self._igp)
+            if self._settings.contract:
+                contract_graphs(self._graphs[t], self._renderer)
+        return self._graphs[t]
+
+    def __getitem__(self, pair):
+        t, s = pair
+        if (s not in self._sources.get(t, [])):
+            raise KeyError(pair)
+        return self.build(t)[pair]
+
+def query_pairs(net, subnets, settings, renderer):
+    """
+    Pairs whose graphs are needed: the pairs of the checked paths or, if no
+    paths are checked, every pair of subnets if graphs are contracted or
+    rendered
+    """
+    if (settings.paths or settings.failures is not None):
+        return [(p.origin, p.endpoint) for p in net.paths
+                if p.origin in subnets and p.endpoint in subnets
+                    and p.origin != p.endpoint]
+    if (settings.contract or renderer.wants('rag') or renderer.wants('rpg')
+            or renderer.wants('tpg')):
+        return [(t, s) for t in subnets for s in subnets if s != t]
+    return []
+
+# State of a worker process, set up once by init_worker
+worker = None
+
+def init_worker(settings, subnets):
+    global worker
+    net = config.Network.load(settings.json_path)
+    l2 = graph.Layer2(net)
+    renderer = render.Renderer.create(settings, collect=True)
+    # Every worker builds the same RAG, so its output is only printed once
+    with contextlib.redirect_stdout(io.StringIO()) as out:
+        graphs = GraphRegistry(net, l2, 
+                query_pairs(net, subnets, settings, renderer), settings, 
+                renderer)
+    worker = (net, graphs, settings, renderer, out.getvalue())
+
+def process_destination(t):
+    """
+    Build the graphs for destination t and run every requested check whose
+    origin is t, in a worker process. Output is captured separately for the
+    worker's RAG, the build and each path (keyed by its index in
+    net.paths), so the caller can print it in the serial order.
+    Graphs to render are returned as DOT, for the caller to draw.
+    """
+    net, graphs, settings, renderer, rag_out = worker
+    reprocess = settings.rules.startswith('redesign')
+
+    # Graphs are built by the first check that needs them, as in a serial run
+    build_out = ''
+    if (not settings.paths and settings.failures is None):
+        with contextlib.redirect_stdout(io.StringIO()) as out:
+            graphs.build(t)
+        build_out = out.getvalue()
+
+    path_outs = {}
+    failure_outs = {}
+    for i, p in enumerate(net.paths):
+        if (p.origin != t):
+            continue
+        if settings.paths:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                check_path(p, graphs[(p.origin, p.endpoint)], 
+                        settings.verbose, reprocess, settings.worklist,
+                        settings.dijkstra)
+            path_outs[i] = out.getvalue()
+        if settings.failures is not None:
+            with contextlib.redirect_stdout(io.StringIO()) as out:
+                check_failure(net, p, graphs[(p.origin, p.endpoint)], 
+                        settings.failures, settings.verbose, reprocess, 
+                        settings.worklist, settings.dijkstra)
+            failure_outs[i] = out.getvalue()
+
+    return (rag_out, build_out, path_outs, failure_outs, renderer.take())
+
+def run_parallel(net, subnets, settings, renderer):
+    """
+    Farm out the work for each destination to a pool of settings.jobs
+    processes, and print the results in the same order as a serial run
+    """
+    pairs = query_pairs(net, subnets, settings, renderer)
+    if (settings.paths or settings.failures is not None):
+        for p in net.paths:
+            if ((p.origin, p.endpoint) not in pairs):
+                raise KeyError((p.origin, p.endpoint))
+    destinations = sorted(set([t for t, _ in pairs]))
+
+    with multiprocessing.Pool(settings.jobs, initializer=init_worker,
+            initargs=(settings, subnets)) as pool:
+        results = pool.map(process_destination, destinations, chunksize=1)
+
+    path_outs = {}
+    failure_outs = {}
+    if (len(results) > 0):
+        print(results[0][0], end='')
+    for _, build_out, dest_path_outs, dest_failure_outs, renders in results:
+        print(build_out, end='')
+        path_outs.update(dest_path_outs)
+        failure_outs.update(dest_failure_outs)
+        renderer.submit(renders)
+    if settings.paths:
+        for i in range(len(net.paths)):
+            print(path_outs[i], end='')
+    if settings.failures is not None:
+        for i in range(len(net.paths)):
+            print(failure_outs[i], end='')
+
+def analyze(net, settings, renderer):
+    """
+    Build, render and check the graphs requested by settings
+    """
+    # Generate physical and layer 2
+    if renderer.wants('physical'):
+        phy = graph.Physical(net)
+        renderer.render(phy, 'physical', 'physical.png')
+    l2 = graph.Layer2(net)
+    renderer.render(l2, 'layer2', 'layer2.png')
+    if renderer.wants('ospf'):
+        ospf = graph.Ospf(net, l2)
+        renderer.render(ospf, 'ospf', 'ospf.png')
+    if renderer.wants('bgp'):
+        bgp = graph.Bgp(net)
+        renderer.render(bgp, 'bgp', 'bgp.png')
+    if renderer.wants('combined'):
+        combined = graph.Combined(net, l2)
+        renderer.render(combined, 'combined', 'combined.png')
+
+
+    # Determine subnets
+    subnets = set()
+    for router in net.routers.values():
+        subnets.update(router.subnets)
+    subnets = sorted(subnets)
+
+    if (settings.jobs > 1):
+        run_parallel(net, subnets, settings, renderer)
+        return
+
+    graphs = GraphRegistry(net, l2, 
+            query_pairs(net, subnets, settings, renderer), settings, renderer)
+    if (not settings.paths and settings.failures is None):
+        for t in graphs.destinations:
+            graphs.build(t)
+
+    if settings.paths:
         check_paths(net, graphs, settings.verbose,
-                settings.rules.startswith('redesign'))
-
-    if settings.contract and graphs is not None:
-        for tc, g in graphs.items():
-            print("TPG %s-%s" % tc)
-            g.contract()
-            g.render(os.path.join(settings.render_path, 
-                        ('tpg-contract_%s-%s.png') % tc))
+                settings.rules.startswith('redesign'), settings.worklist,
+                settings.dijkstra)
+
+    if settings.failures is not None:
+        check_failures(net, graphs, settings.failures, settings.verbose,
+                settings.rules.startswith('redesign'), settings.worklist,
+                settings.dijkstra)
+
+def main():
+    # Parse arguments
+    arg_parser = ArgumentParser(description='Tiramisu prototype')
+    arg_parser.add_argument('-json', dest='json_path', action='store',
+            required=True, help='Path to network json')
+    arg_parser.add_argument('-render', dest='render_path', action='store',
+            help='Path to render graphs (graphs are not rendered if omitted)')
+    arg_parser.add_argument('-render-kinds', dest='render_kinds', 
+            action='store', nargs='+', choices=render.KINDS, metavar='KIND',
+            help='Kinds of graphs to render (default: all): %s' % 
+                ', '.join(render.KINDS))
+    arg_parser.add_argument('-render-max-size', dest='render_max_size',
+            action='store', type=int, metavar='N',
+            help='Do not lay out graphs with more than N vertices using dot')
+    arg_parser.add_argument('-render-large-prog', dest='render_large_prog',
+            action='store', metavar='PROG',
+            help='Graphviz program (e.g., sfdp) used to lay out graphs above '
+                'the maximum size, instead of skipping them')
+    arg_parser.add_argument('-render-jobs', dest='render_jobs', 
+            action='store', type=int, default=1, metavar='N',
+            help='Render graphs in N background processes (0 renders in the '
+                'foreground)')
+    arg_parser.add_argument('-rules', dest='rules', action='store',
+            help='Rules to follow', required=True,
+            choices=["nsdi", "prensdi", "nsditpg", "prensdimod", "nsdimod", 
+                "redesign"])
+    arg_parser.add_argument('-paths', dest='paths', action='store_true',
+            help='Check paths')
+    arg_parser.add_argument('-verbose', dest='verbose', action='store_true',
+            help='Verbose output')
+    arg_parser.add_argument('-contract', dest='contract', action='store_true',
+            help='Contract chains of vertices in TPGs and solve TPVP on the '
+                + 'contracted graphs (a vertex may keep a different one of '
+                + 'several equally good paths, or first offered path, than '
+                + 'TPVP on the graph as built)')
+    arg_parser.add_argument('-worklist', dest='worklist', action='store_true',
+            help='Only re-rank changed vertices in each TPVP round')
+    arg_parser.add_argument('-dijkstra', dest='dijkstra', action='store_true',
+            help='Compute best paths within the IGP with Dijkstra\'s '
+                + 'algorithm (every IGP vertex takes a least-cost path, '
+                + 'whereas TPVP only compares costs at OSPF vertices, so '
+                + 'paths and costs may differ from TPVP)')
+    arg_parser.add_argument('-failures', dest='failures', action='store',
+            type=int, metavar='K', 
+            help='Check paths under all combinations of up to K link failures')
+    arg_parser.add_argument('-jobs', dest='jobs', action='store', type=int,
+            default=1, metavar='N',
+            help='Build and check graphs for each destination in N processes')
+    settings = arg_parser.parse_args()
+    print("Settings: %s" % settings)
+
+    net = config.Network.load(settings.json_path)
+#    print(net)
+    renderer = render.Renderer.create(settings)
+    # Renders finished before an error are still recorded in the manifest
+    try:
+        analyze(net, settings, renderer)
+    finally:
+        renderer.wait()
 
 if __name__ == '__main__':
     main()
@@ -1,61 +1,438 @@
 #!/usr/bin/python3
 
+import array
+import collections
+import config
 import copy
-import pygraphviz
+import hashlib
+import heapq
 from tabulate import tabulate
 
+class Subgraph:
+    def __init__(self, name=None, color="black", shape="ellipse", rank='same',
+            supergraph=None):
+        self._name = name
+        self._color = color
+        self._shape = shape
+        self._rank = rank
+        self._supergraph = supergraph
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def color(self):
+        return self._color
+
+    @property
+    def shape(self):
+        return self._shape
+
+    @property
+    def rank(self):
+        return self._rank
+
+    @property
+    def supergraph(self):
+        return self._supergraph
+
+class Label:
+    """
+    Pre-parsed edge label used by TPVP. Costs and lengths are added to a
+    signature, local preference replaces it, and tags are first checked
+    against the block list, then removed, then added. Tags are bitmasks
+    over the network's tag universe (see config.Network.tag_mask). A label
+    that blocks all signatures (see compose) has no other effect.
+    """
+    __slots__ = ('cost', 'len', 'lp', 'add_tags', 'remove_tags', 
+            'block_tags', 'blocks_all')
+
+    def __init__(self, cost=0, len=0, lp=None, add_tags=0, remove_tags=0, 
+            block_tags=0, blocks_all=False):
+        self.cost = cost
+        self.len = len
+        self.lp = lp
+        self.add_tags = add_tags
+        self.remove_tags = remove_tags
+        self.block_tags = block_tags
+        self.blocks_all = blocks_all
+
+    @classmethod
+    def create(cls, label_json, net):
+        if (label_json is None):
+            return None
+        return Label(int(label_json.get('cost', 0)), 
+                int(label_json.get('len', 0)),
+                (int(label_json['lp']) if 'lp' in label_json else None),
+                net.tag_mask(label_json.get('at', [])),
+                net.tag_mask(label_json.get('rt', [])),
+                net.tag_mask(label_json.get('bt', [])))
+
+    @staticmethod
+    def compose(outer, inner):
+        """
+        Label equivalent to applying inner and then outer (e.g., the labels
+        of edges u > v and v > w, in that order, for the path u > v > w);
+        either may be None. If outer blocks a tag that inner adds, every
+        signature is blocked.
+        """
+        if (outer is None):
+            return inner
+        if (inner is None):
+            return outer
+        if (outer.blocks_all or inner.blocks_all
+                or (inner.add_tags & outer.block_tags) != 0):
+            return Label(blocks_all=True)
+        return Label(cost=outer.cost + inner.cost, len=outer.len + inner.len,
+                lp=(inner.lp if outer.lp is None else outer.lp),
+                add_tags=((inner.add_tags & ~outer.remove_tags) 
+                    | outer.add_tags),
+                remove_tags=inner.remove_tags | outer.remove_tags,
+                block_tags=(inner.block_tags 
+                    | (outer.block_tags & ~inner.remove_tags)))
+
+    def to_json(self, net):
+        if (self.blocks_all):
+            return {'blocked' : True}
+        label = {}
+        if (self.cost != 0):
+            label['cost'] = self.cost
+        if (self.len != 0):
+            label['len'] = self.len
+        if (self.lp is not None):
+            label['lp'] = self.lp
+        if (self.add_tags != 0):
+            label['at'] = net.tag_names(self.add_tags)
+        if (self.remove_tags != 0):
+            label['rt'] = net.tag_names(self.remove_tags)
+        if (self.block_tags != 0):
+            label['bt'] = net.tag_names(self.block_tags)
+        return label
+
+class Signature(collections.namedtuple('Signature', 
+        ['lp', 'len', 'cost', 'tags'])):
+    """
+    Immutable route signature computed by TPVP. Tags are a bitmask over the
+    network's tag universe, so deriving a signature never copies a
+    collection.
+    """
+    __slots__ = ()
+
+class PathNode:
+    """
+    Immutable path represented as a vertex and a pointer to the rest of the
+    path (i.e., the next hop's PathNode). Paths that extend the same path
+    share it.
+    """
+    __slots__ = ('vertex', 'next')
+
+    def __init__(self, vertex, next):
+        self.vertex = vertex
+        self.next = next
+
+    @staticmethod
+    def same(p, q):
+        while (p is not q):
+            if (p is None or q is None or p.vertex != q.vertex):
+                return False
+            p = p.next
+            q = q.next
+        return True
+
+    def contains(self, vertex):
+        node = self
+        while (node is not None):
+            if (node.vertex == vertex):
+                return True
+            node = node.next
+        return False
+
+    def vertices(self):
+        path = []
+        node = self
+        while (node is not None):
+            path.append(node.vertex)
+            node = node.next
+        return path
+
+class Edge:
+    __slots__ = ('seq', 'src', 'dst', 'color', 'style', 'label', 'headlabel',
+            'taillabel', 'dir', 'link')
+
+    def __init__(self, seq, src, dst, color='black', style='solid', label=None,
+            headlabel='', taillabel=''):
+        self.seq = seq
+        self.src = src
+        self.dst = dst
+        self.color = color
+        self.style = style
+        self.label = label
+        self.headlabel = headlabel
+        self.taillabel = taillabel
+        self.dir = None
+        self.link = None
+
 class Graph:
+    """
+    Directed multigraph with integer vertex ids. Each vertex keeps its out
+    edges ordered by (destination, creation) and its in edges ordered by
+    (source, creation), which matches the iteration order of Graphviz. A
+    pygraphviz.AGraph is only materialised when the graph is rendered.
+    """
     def __init__(self, net):
-        self._graph = pygraphviz.AGraph(strict=False, directed=True, 
-                ranksep=1.5)
         self._net = net
-
-    def render(self, file_path):
-        self._graph.layout(prog='dot')
-        self._graph.draw(file_path, prog='dot')
+        self._names = []
+        self._ids = {}
+        self._colors = []
+        self._fontcolors = []
+        self._shapes = []
+        self._vertex_subs = []
+        self._out = []
+        self._in = []
+        self._edges = []
+        self._subgraphs = []
+
+    def render(self, file_path, prog='dot'):
+        # Drawing with a prog lays out the graph, so no separate layout
+        agraph = self.to_agraph()
+        agraph.draw(file_path, prog=prog)
+
+    def to_agraph(self):
+        import pygraphviz
+        agraph = pygraphviz.AGraph(strict=False, directed=True, ranksep=1.5)
+
+        subs = {}
+        for sub in self._subgraphs:
+            supergraph = (agraph if sub.supergraph is None 
+                    else subs[sub.supergraph])
+            if (sub.rank is None):
+                subgraph = supergraph.add_subgraph(name=sub.name)
+            else:
+                subgraph = supergraph.add_subgraph(name=sub.name, 
+                        rank=sub.rank)
+            subgraph.node_attr['color'] = sub.color
+            subgraph.node_attr['fontcolor'] = sub.color
+            subgraph.node_attr['shape'] = sub.shape
+            subs[sub] = subgraph
+
+        for v in self.vertices():
+            attr = {}
+            if (self._colors[v] is not None):
+                attr['color'] = self._colors[v]
+            if (self._fontcolors[v] is not None):
+                attr['fontcolor'] = self._fontcolors[v]
+            if (self._shapes[v] is not None):
+                attr['shape'] = self._shapes[v]
+            sub = self._vertex_subs[v]
+            (agraph if sub is None else subs[sub]).add_node(self._names[v],
+                    **attr)
+
+        for e in self._edges:
+            if (e is None):
+                continue
+            attr = {}
+            if (e.dir is not None):
+                attr['dir'] = e.dir
+            agraph.add_edge(self._names[e.src], self._names[e.dst], 
+                    color=e.color, fontcolor=e.color, style=e.style, 
+                    label=self.label_str(e.label), 
+                    headlabel=e.headlabel, 
+                    taillabel=e.taillabel, fontsize=10.0, **attr)
+
+        return agraph
+
+    def digest(self):
+        """
+        Digest of everything to_agraph puts in the AGraph, in the same order,
+        so graphs with the same digest render to the same image
+        """
+        h = hashlib.sha256()
+        subs = {None : None}
+        for sub in self._subgraphs:
+            subs[sub] = len(subs) - 1
+            h.update(repr(('subgraph', sub.name, sub.color, sub.shape, 
+                    sub.rank, subs[sub.supergraph])).encode())
+        for v in self.vertices():
+            h.update(repr(('vertex', self._names[v], self._colors[v], 
+                    self._fontcolors[v], self._shapes[v], 
+                    subs[self._vertex_subs[v]])).encode())
+        for e in self._edges:
+            if (e is None):
+                continue
+            h.update(repr(('edge', self._names[e.src], self._names[e.dst], 
+                    e.color, e.style, self.label_str(e.label), e.headlabel,
+                    e.taillabel, e.dir)).encode())
+        return h.hexdigest()
+
+    def label_str(self, label):
+        if (label is None):
+            return ''
+        elif (isinstance(label, Label)):
+            return str(label.to_json(self._net))
+        return str(label)
 
     def add_vertex(self, name, color='black', shape='ellipse', subgraph=None):
         if (subgraph is not None):
-            subgraph.add_node(name, 
-                    color=(subgraph.node_attr['color'] 
-                        if color=="black" else color), 
-                    fontcolor=(subgraph.node_attr['fontcolor']
-                        if color=="black" else color),
-                    shape=(subgraph.node_attr['shape']
-                        if shape=="ellipse" else shape))
+            fontcolor = (subgraph.color if color=="black" else color)
+            color = fontcolor
+            shape = (subgraph.shape if shape=="ellipse" else shape)
         else:
-            self._graph.add_node(name, color=color, fontcolor=color, 
-                    shape=shape)
-        return self.get_vertex(name)
+            fontcolor = color
+        return self._add_vertex(name, color, fontcolor, shape, subgraph)
+
+    def _add_vertex(self, name, color=None, fontcolor=None, shape=None,
+            subgraph=None):
+        name = str(name)
+        v = self._ids.get(name)
+        if (v is None):
+            v = len(self._names)
+            self._ids[name] = v
+            self._names.append(name)
+            self._colors.append(color)
+            self._fontcolors.append(fontcolor)
+            self._shapes.append(shape)
+            self._vertex_subs.append(subgraph)
+            self._out.append([])
+            self._in.append([])
+        else:
+            self._colors[v] = color
+            self._fontcolors[v] = fontcolor
+            self._shapes[v] = shape
+            if (subgraph is not None):
+                self._vertex_subs[v] = subgraph
+        return v
 
     def get_vertex(self, name):
-        return self._graph.get_node(name)
+        return self._ids[name]
 
     def has_vertex(self, name):
-        return self._graph.has_node(name)
+        return name in self._ids
+
+    def vertex_name(self, v):
+        return self._names[v]
+
+    def vertex_color(self, v):
+        return self._colors[v]
+
+    def set_vertex_color(self, v, color):
+        self._colors[v] = color
+
+    def vertex_fontcolor(self, v):
+        return self._fontcolors[v]
+
+    def path_names(self, path):
+        return [self.vertex_name(v) for v in path]
+
+    def vertices(self):
+        return [v for v in range(len(self._names)) 
+                if self._names[v] is not None]
+
+    def num_vertices(self):
+        return len(self._names)
+
+    def edges(self):
+        return [e for e in self._edges if e is not None]
+
+    def copy(self):
+        """
+        Copy of the graph whose vertices and edges can be added and removed
+        without changing the graph
+        """
+        g = copy.copy(self)
+        g._names = list(self._names)
+        g._ids = dict(self._ids)
+        g._colors = list(self._colors)
+        g._fontcolors = list(self._fontcolors)
+        g._shapes = list(self._shapes)
+        g._vertex_subs = list(self._vertex_subs)
+        g._out = [list(edges) for edges in self._out]
+        g._in = [list(edges) for edges in self._in]
+        g._edges = list(self._edges)
+        return g
+
+    def remove_vertex(self, v):
+        for e in self._out[v]:
+            self._in[e.dst].remove(e)
+            self._edges[e.seq] = None
+        for e in self._in[v]:
+            if (e.src != v):
+                self._out[e.src].remove(e)
+            self._edges[e.seq] = None
+        self._out[v] = []
+        self._in[v] = []
+        del self._ids[self._names[v]]
+        self._names[v] = None
 
     def add_edge(self, src, dst, combine=False, color='black', style='solid',
             label=None, headlabel='', taillabel=''):
-        if (combine and self._graph.has_edge(dst, src)):
-            self._graph.get_edge(dst, src).attr['dir'] = 'both'
-        else:
-            self._graph.add_edge(src, dst, color=color, fontcolor=color,
-                    style=style, label=('' if label is None else label), 
-                    headlabel=headlabel,
-                    taillabel=taillabel, fontsize=10.0)
+        if (combine and self.has_edge(dst, src)):
+            self.get_edge(dst, src).dir = 'both'
+            return
+
+        if (src not in self._ids):
+            self._add_vertex(src)
+        if (dst not in self._ids):
+            self._add_vertex(dst)
+        s = self._ids[src]
+        d = self._ids[dst]
+
+        e = Edge(len(self._edges), s, d, color=color, style=style,
+                label=label,
+                headlabel=headlabel, taillabel=taillabel)
+        e.link = self.link_id(src, dst)
+        self._edges.append(e)
+
+        # Keep out edges ordered by destination and in edges by source
+        out_edges = self._out[s]
+        i = len(out_edges)
+        while (i > 0 and out_edges[i-1].dst > d):
+            i -= 1
+        out_edges.insert(i, e)
+        in_edges = self._in[d]
+        i = len(in_edges)
+        while (i > 0 and in_edges[i-1].src > s):
+            i -= 1
+        in_edges.insert(i, e)
+        return e
+
+    def link_id(self, src, dst):
+        return None
+
+    def get_edge(self, src, dst):
+        s = self._ids[src]
+        d = self._ids[dst]
+        for e in self._out[s]:
+            if (e.dst == d):
+                return e
+        raise KeyError("Edge %s -> %s not in graph" % (src, dst))
 
     def has_edge(self, src, dst, either=False):
-        return (self._graph.has_edge(src, dst) or
-                (either and self.graph.has_edge(dst, src)))
+        if (src not in self._ids or dst not in self._ids):
+            return False
+        s = self._ids[src]
+        d = self._ids[dst]
+        for e in self._out[s]:
+            if (e.dst == d):
+                return True
+        return either and self.has_edge(dst, src)
+
+    def out_edges(self, v):
+        return self._out[v]
+
+    def in_edges(self, v):
+        return self._in[v]
+
+    def out_degree(self, v):
+        return len(self._out[v])
+
+    def in_degree(self, v):
+        return len(self._in[v])
 
     def add_subgraph(self, name=None, color="black", shape="ellipse", 
             rank='same', supergraph=None):
-        if (supergraph is None):
-            supergraph = self._graph
-        subgraph = supergraph.add_subgraph(name=name, rank=rank)
-        subgraph.node_attr['color'] = color
-        subgraph.node_attr['fontcolor'] = color
-        subgraph.node_attr['shape'] = shape
+        subgraph = Subgraph(name, color, shape, rank, supergraph)
+        self._subgraphs.append(subgraph)
         return subgraph
 
 class Physical(Graph):
@@ -79,12 +456,26 @@ class Physical(Graph):
 
 
 class Layer2(Graph):
+    """
+    Layer 2 graph of VLANs and interfaces. VLANs connected through layer 2
+    form a broadcast domain (i.e., a connected component of the graph, whose
+    edges are all bidirectional); domains are computed once, and the VLANs
+    adjacent to a config.Vlan are derived from its domain the first time
+    they are looked up and remembered. Dashed edges between adjacent VLANs
+    are only added when the graph is rendered.
+    """
     def __init__(self, net):
         super().__init__(net)
 
         self._vlan_sub = self.add_subgraph("vlan", color="purple")
         self._iface_sub = self.add_subgraph("iface", color="blue")
 
+        self._vlans = {}
+        self._vlan_vertices = {}
+        self._domains = {}
+        self._adjacent = {}
+        self._adjacent_edges = False
+
         for router in net.routers.values():
             self.add_vlan_vertices(router)
             self.add_iface_vertices(router)
@@ -93,13 +484,14 @@ class Layer2(Graph):
             self.add_vlan_edges(router)
             self.add_iface_edges(router)
 
-        for router in net.routers.values():
-            self.add_adjacent_vlan_edges(router)
+        self.find_domains()
 
     def add_vlan_vertices(self, router):
         for vlan in router.vlans.values():
-            self.add_vertex(self.vlan_name(vlan), 
+            vertex = self.add_vertex(self.vlan_name(vlan), 
                     subgraph=self._vlan_sub)
+            self._vlans[vertex] = vlan
+            self._vlan_vertices[vlan] = vertex
 
     def add_iface_vertices(self, router):
         for iface in router.ifaces.values():
@@ -124,30 +516,56 @@ class Layer2(Graph):
     def iface_name(self, iface):
         return "%s:%s" % (iface.router.name, iface.neighbor.router.name)
 
-
-    def add_adjacent_vlan_edges(self, router):
-        for vlan in router.vlans.values():
-            vertex = self.get_vertex(self.vlan_name(vlan))
-            self.dfs(vertex, vertex, [])
-
-    def dfs(self, origin, vertex, visited):
-        if (vertex in visited):
+    def find_domains(self):
+        """
+        Map each VLAN vertex to the VLAN vertices in its broadcast domain,
+        ordered by vertex id, with a single traversal of the graph
+        """
+        reached = [False] * self.num_vertices()
+        for origin in self.vertices():
+            if (reached[origin]):
+                continue
+            reached[origin] = True
+            domain = []
+            stack = [origin]
+            while (len(stack) > 0):
+                vertex = stack.pop()
+                if (vertex in self._vlans):
+                    domain.append(vertex)
+                for edge in self.out_edges(vertex):
+                    if (not reached[edge.dst]):
+                        reached[edge.dst] = True
+                        stack.append(edge.dst)
+            domain.sort()
+            for vertex in domain:
+                self._domains[vertex] = domain
+
+    def add_adjacent_vlan_edges(self):
+        if (self._adjacent_edges):
             return
-        visited.append(vertex)
-
-        if ("VLAN" in vertex and vertex != origin):
-            self.add_edge(origin, vertex, style="dashed", color="purple")
-
-        for edge in self._graph.out_edges(vertex):
-            if (edge.attr["style"] == "solid"):
-                self.dfs(origin, edge[1], visited)
+        self._adjacent_edges = True
+        for vertex in list(self._vlans.keys()):
+            for adjacent in self._domains[vertex]:
+                if (adjacent != vertex):
+                    self.add_edge(self.vertex_name(vertex), 
+                            self.vertex_name(adjacent), style="dashed", 
+                            color="purple")
+
+    def to_agraph(self):
+        self.add_adjacent_vlan_edges()
+        return super().to_agraph()
+
+    def digest(self):
+        self.add_adjacent_vlan_edges()
+        return super().digest()
 
     def get_adjacent_vlans(self, vlan):
-        adjacent = []
-        for edge in self._graph.out_edges(self.vlan_name(vlan)):
-            if (edge.attr["style"] == "dashed"):
-                router, _, num = str(edge[1]).split(':')
-                adjacent.append(self._net.routers[router].vlans[int(num)])
+        adjacent = self._adjacent.get(vlan)
+        if (adjacent is None):
+            vertex = self._vlan_vertices[vlan]
+            adjacent = tuple([self._vlans[other] 
+                    for other in self._domains[vertex] if other != vertex])
+            self._adjacent[vlan] = adjacent
         return adjacent
 
 class Ospf(Graph):
@@ -174,29 +592,92 @@ class Ospf(Graph):
                 for adjacent in self._l2.get_adjacent_vlans(vlan):
                     if (adjacent.router.ospf is not None):
                         self.add_edge(router.name, adjacent.router.name, 
-                                color="forestgreen", label={'cost':1})
+                                color="forestgreen", label=Label(cost=1))
 
             for subnet in router.ospf.origins:
                 self.add_edge(router.name, subnet, color="red")
 
-    def tpvp(self, t):
+    def tpvp(self, t, verbose=False):
+        """
+        Compute and print every vertex's best path to subnet t. OSPF ranks
+        paths by cost alone, so the paths are found with Dijkstra's
+        algorithm; verbose runs iterate TPVP instead, printing every round.
+        """
+        if (verbose):
+            bestpath, bestsign = self.run_tpvp(t)
+        else:
+            bestpath, bestsign = self.dijkstra(t)
+
+        print("TPVP:")
+        print(self.named_paths(bestpath))
+        print(self.named_signs(bestsign))
+
+    def dijkstra(self, t):
+        """
+        Compute the paths TPVP converges to: each vertex's path goes through
+        the first out neighbor (in path_rank's order) on a least-cost path
+        """
+        dst = self.get_vertex(t)
+        cost = {dst : 0}
+        heap = [(0, dst)]
+        while (len(heap) > 0):
+            c, v = heapq.heappop(heap)
+            if (c > cost[v]):
+                continue
+            for e in self.in_edges(v):
+                u = e.src
+                uc = c + (0 if e.label is None else e.label.cost)
+                if (u not in cost or uc < cost[u]):
+                    cost[u] = uc
+                    heapq.heappush(heap, (uc, u))
+
+        # Like path_rank, only the last of several parallel edges counts
+        nexthop = {}
+        for u in cost:
+            if (u == dst):
+                continue
+            labels = {}
+            for e in self.out_edges(u):
+                labels[e.dst] = e.label
+            for v,label in labels.items():
+                if (v in cost and cost[u] == cost[v]
+                        + (0 if label is None else label.cost)):
+                    nexthop[u] = v
+                    break
+
+        bestpath = {}
+        bestsign = {}
+        for u in self.vertices():
+            bestpath[u] = None
+            bestsign[u] = None
+            if (u in cost):
+                bestsign[u] = {'cost':cost[u]}
+                bestpath[u] = [u]
+                v = u
+                while (v != dst):
+                    v = nexthop[v]
+                    bestpath[u].append(v)
+
+        return bestpath, bestsign
+
+    def run_tpvp(self, t):
         # Line 2
         path = {}
         sign = {}
         bestpath = {}
         bestsign = {}
-        for u in self._graph.nodes():
+        for u in self.vertices():
             path[u] = {}
             sign[u] = {}
             bestpath[u] = None
             bestsign[u] = None
-            for v in self._graph.out_neighbors(u):
-                path[u][v] = None
-                sign[u][v] = None
+            for e in self.out_edges(u):
+                path[u][e.dst] = None
+                sign[u][e.dst] = None
 
         # Line 3
         dst = self.get_vertex(t)
-        bestpath[dst] = [t]
+        bestpath[dst] = [dst]
         bestsign[dst] = {'cost':0}
         
         change = True
@@ -204,20 +685,20 @@ class Ospf(Graph):
         # Line 4
         while change:
 
-            print(bestpath)
-            print(bestsign)
+            print(self.named_paths(bestpath))
+            print(self.named_signs(bestsign))
 
             change = False
 
             # Line 5
-            for u in self._graph.nodes():
+            for u in self.vertices():
 
                 if (u == dst): 
                     continue
 
                 # Line 6
-                for e in self._graph.out_edges(u):
-                    v = e[1]
+                for e in self.out_edges(u):
+                    v = e.dst
 
                     if (bestpath[v] is not None):
 
@@ -225,10 +706,7 @@ class Ospf(Graph):
                         path[u][v] = [u] + bestpath[v]
 
                         # Line 8
-                        L = {}
-                        if "label" in e.attr and e.attr["label"] != '':
-                            L = eval(e.attr["label"])
-                        sign[u][v] = self.sign_combine(L, bestsign[v])
+                        sign[u][v] = self.sign_combine(e.label, bestsign[v])
 
                 # Line 9
                 newbestpath, newbestsign = self.path_rank(path[u], sign[u])
@@ -236,20 +714,26 @@ class Ospf(Graph):
                 # Line 10
                 if newbestpath != bestpath[u] or newbestsign != bestsign[u]:
 
-                    print("CHANGE: %s" % u)
+                    print("CHANGE: %s" % self.vertex_name(u))
                     bestpath[u] = newbestpath
                     bestsign[u] = newbestsign
 
                     # Line 11
                     change = True
 
-        print("TPVP:")
-        print(bestpath)
-        print(bestsign)
+        return bestpath, bestsign
+
+    def named_paths(self, paths):
+        return {self.vertex_name(u) : (None if p is None 
+                else self.path_names(p)) 
+            for u,p in paths.items()}
+
+    def named_signs(self, signs):
+        return {self.vertex_name(u) : s for u,s in signs.items()}
 
     def sign_combine(self, label, sign):
         return {'cost' : 
-                (label['cost'] if 'cost' in label else 0) 
+                (0 if label is None else label.cost) 
                     + (sign['cost'] if 'cost' in sign else 0)}
 
     def path_rank(self, paths, signs):
@@ -364,140 +848,901 @@ class Combined(Graph):
                 for subnet in router.bgp.origins:
                     self.add_edge(subnet, "%s:BGP" % router.name, color="red")
 
+class RAG(Graph):
+    """
+    Routing adjacency graph for one or more destination subnets. Each subnet
+    has a vertex with edges to the processes that originate it; the rest of
+    the graph is the same for every subnet, so it is built once. The
+    subnets that taint each vertex are recorded as a bitset (bit i is the
+    i-th subnet). Routes learned over an iBGP (dashed) edge are not
+    re-advertised over another iBGP edge.
+    """
+    def __init__(self, net, subnets=[]):
+        super().__init__(net)
+        self._subnets = list(subnets)
+        self._subnet_bits = {}
+        for i, subnet in enumerate(self._subnets):
+            self._subnet_bits[subnet] = 1 << i
+        self._taints = None
+        self._advertises = None
+
+    @property
+    def subnets(self):
+        return self._subnets
+
+    def add_origin_edges(self, origins, vertex_name):
+        for subnet in self._subnets:
+            if (subnet in origins):
+                self.add_edge(subnet, vertex_name, color="red")
+
+    def taint(self, verbose=False):
+        """
+        Taint the vertices reachable from each subnet's vertex with the
+        subnet's bit, for all subnets in one worklist pass: a vertex is
+        (re)visited whenever it gains bits, and passes only the new bits on.
+        A vertex only advertises over iBGP the subnets it learns other than
+        over iBGP, however it first learned them.
+        """
+        # Subnets that taint each vertex, and the subnets each vertex may
+        # advertise over iBGP (i.e., not only learned over iBGP)
+        self._taints = [0] * self.num_vertices()
+        self._advertises = [0] * self.num_vertices()
+        if (verbose):
+            print("Tainting %s..." % ', '.join(self._subnets))
+        pending = []
+        for subnet in self._subnets:
+            v = self.get_vertex(subnet)
+            self._taints[v] |= self._subnet_bits[subnet]
+            self._advertises[v] |= self._subnet_bits[subnet]
+            pending.append(v)
+        queued = set(pending)
+        while (len(pending) > 0):
+            u = pending.pop()
+            queued.discard(u)
+            for edge in self.out_edges(u):
+                v = edge.dst
+                bits = self.edge_taints(edge)
+                taints = bits & ~self._taints[v]
+                advertises = (0 if edge.style == "dashed"
+                        else bits & ~self._advertises[v])
+                if (taints == 0 and advertises == 0):
+                    continue
+                if (verbose and taints != 0):
+                    print("\tTaint %s from %s with %s" % (self.vertex_name(v),
+                            self.vertex_name(u),
+                            ', '.join(self.bit_subnets(taints))))
+                self._taints[v] |= taints
+                self._advertises[v] |= advertises
+                if (v not in queued):
+                    pending.append(v)
+                    queued.add(v)
+
+    def edge_taints(self, edge):
+        """
+        Subnets whose taint propagates over an edge
+        """
+        if (edge.style == "dashed"):
+            return self._advertises[edge.src]
+        return self._taints[edge.src]
+
+    def bit_subnets(self, bits):
+        return [subnet for subnet in self._subnets
+                if bits & self._subnet_bits[subnet]]
+
+    def is_tainted(self, process, subnet):
+        if (type(process) is config.Ospf):
+            vertex_name = self.ospf_name(process.router)
+        elif (type(process) is config.Bgp):
+            vertex_name = self.bgp_name(process.router)
+        return ((self._taints[self.get_vertex(vertex_name)]
+                & self._subnet_bits[subnet]) != 0)
+
+    def view(self, subnet):
+        """
+        Copy of the graph with only the vertex for one of the subnets, in
+        which the vertices and edges tainted by the subnet are red (e.g., for
+        rendering)
+        """
+        bit = self._subnet_bits[subnet]
+        others = set([self.get_vertex(other) for other in self._subnets
+                if other != subnet])
+        view = Graph(self._net)
+        view._subgraphs = self._subgraphs
+        for v in self.vertices():
+            if (v in others):
+                continue
+            view._add_vertex(self._names[v],
+                    ("red" if self._taints[v] & bit else self._colors[v]),
+                    self._fontcolors[v], self._shapes[v], self._vertex_subs[v])
+        for e in self._edges:
+            if (e is None or e.src in others):
+                continue
+            edge = view.add_edge(self._names[e.src], self._names[e.dst],
+                    color=("red" if self.edge_taints(e) & bit else e.color),
+                    style=e.style, label=e.label, headlabel=e.headlabel,
+                    taillabel=e.taillabel)
+            edge.dir = e.dir
+        return view
+
+class IgpTable:
+    """
+    Least-cost (then fewest-hop) paths between the vertices of an IGP layer
+    (a graph whose edges only add cost) that many TPGs traverse, so the
+    paths are computed once and shared by every TPG (see Segment).
+    A target's column of the table is computed with Dijkstra's algorithm the
+    first time it is needed for a failset, and stored in arrays indexed by
+    vertex.
+
+    Only redesign TPGs use a table, because only they contain replicas of a
+    self-contained IGP layer. In NSDI and pre-NSDI TPGs, VLAN vertices also
+    lead to BGP and subnet vertices, and which of them lead to OSPF depends
+    on the destination's taint, so their IGP region is different in every
+    TPG and is solved within it (with -dijkstra, see TPG.solve_igp).
+    """
+    # Maximum number of columns (i.e., targets and failsets) remembered
+    COLUMN_CACHE_SIZE = 1024
+
+    def __init__(self, g):
+        self._size = g.num_vertices()
+        self._names = [g.vertex_name(v) for v in range(self._size)]
+        self._edges = []
+        self._in = [[] for v in range(self._size)]
+        self._links = set()
+        for e in g.edges():
+            self._in[e.dst].append(len(self._edges))
+            self._edges.append((e.src, e.dst, e.label, e.link))
+            if (e.link is not None):
+                self._links.add(e.link)
+        self._columns = {}
+
+    @property
+    def links(self):
+        return self._links
+
+    def vertex_name(self, v):
+        return self._names[v]
+
+    def edge(self, i):
+        return self._edges[i]
+
+    def path(self, source, target, failset=frozenset()):
+        """
+        Vertices on the best path from source to target, or None if there is
+        no path
+        """
+        cost, _, nextedge, _ = self.column(target, failset)
+        if (cost[source] < 0):
+            return None
+        path = [source]
+        while (path[-1] != target):
+            path.append(self._edges[nextedge[path[-1]]][1])
+        return path
+
+    def column(self, target, failset=frozenset()):
+        """
+        Compute the cost and hop count of each vertex's best path to target,
+        the index of the first edge (see edge) on the path, and the order in
+        which the vertices were reached; vertices without a path have a cost
+        of -1
+        """
+        # Failures of links outside the layer do not change its paths
+        failset = frozenset(failset & self._links)
+        key = (target, failset)
+        if (key in self._columns):
+            return self._columns[key]
+
+        cost = array.array('l', [-1]) * self._size
+        hops = array.array('l', [-1]) * self._size
+        nextedge = array.array('l', [-1]) * self._size
+        order = array.array('l')
+        done = bytearray(self._size)
+        cost[target] = 0
+        hops[target] = 0
+        heap = [(0, 0, target)]
+        while (len(heap) > 0):
+            c, h, v = heapq.heappop(heap)
+            if (done[v]):
+                continue
+            done[v] = 1
+            order.append(v)
+            for i in self._in[v]:
+                u, _, label, link = self._edges[i]
+                if (done[u] or link in failset):
+                    continue
+                uc = c + (0 if label is None else label.cost)
+                if (cost[u] < 0 or (uc, h + 1) < (cost[u], hops[u])):
+                    cost[u] = uc
+                    hops[u] = h + 1
+                    nextedge[u] = i
+                    heapq.heappush(heap, (uc, h + 1, u))
+
+        if (len(self._columns) >= self.COLUMN_CACHE_SIZE):
+            del self._columns[next(iter(self._columns))]
+        self._columns[key] = (cost, hops, nextedge, order)
+        return self._columns[key]
+
+class Segment:
+    """
+    Replica of an IGP layer in a TPG, entered at the replica of the layer's
+    source vertex and left at the replica of its target vertex. Only the
+    entry is a vertex of the TPG; its only out edge (the exit) leads to the
+    vertex the replica is left for. The entry's best path is its best path
+    through the layer (see IgpTable) followed by the exit, and is expanded
+    into the names of the replica's vertices, i.e., the layer's vertices
+    behind prefix (see TPG.expand).
+
+    TPVP follows the table through a replica in every mode, not only with
+    -dijkstra, so the path through it is always a least-cost (then
+    fewest-hop) path. This differs from running TPVP on the replica's
+    vertices, where a VLAN vertex keeps the first path it is offered (see
+    TPG.solve_igp), which may cost more. That choice only reflects the order
+    in which the replica's vertices were added to the TPG, whereas the
+    routers forward along OSPF's least-cost paths, which are what the
+    layer's costs model. Reproducing it would require instantiating every
+    replica's vertices in every TPG.
+    """
+    __slots__ = ('table', 'source', 'target', 'prefix')
+
+    def __init__(self, table, source, target, prefix):
+        self.table = table
+        self.source = source
+        self.target = target
+        self.prefix = prefix
+
+    def cost(self, failset=frozenset()):
+        """
+        Cost of the best path from source to target, or -1 if there is none
+        """
+        return self.table.column(self.target, failset)[0][self.source]
+
+    def names(self, failset=frozenset()):
+        return [self.prefix + self.table.vertex_name(v) 
+                for v in self.table.path(self.source, self.target, failset)]
+
+class Chain:
+    """
+    Vertices (by name) contracted into a single vertex, and the labels and
+    links of the edges between consecutive vertices (see TPG.contract)
+    """
+    __slots__ = ('names', 'labels', 'links')
+
+    def __init__(self, names, labels, links):
+        self.names = names
+        self.labels = labels
+        self.links = links
+
 class TPG(Graph):
+    """
+    Traffic propagation graph for a destination subnet t and one or more
+    source subnets. A TPG built for a (t, s) pair has a single source; a TPG
+    built for (t, [s1, s2, ...]) is a base graph for t, to which each source
+    is attached (see add_source) by adding only its vertex and out edges.
+    Sources only have out edges, so TPVP computes the same best paths for
+    every other vertex regardless of the sources, and one solution answers
+    the queries for all of them.
+    """
+    # Maximum number of TPVP solutions (i.e., failsets) remembered
+    SOLUTION_CACHE_SIZE = 64
+
     def __init__(self, net, subnets):
         super().__init__(net)
 
         self._t, self._s = subnets
+        if (isinstance(self._s, str)):
+            self._name = "%s-%s" % (self._t, self._s)
+            self._sources = [self._s]
+        else:
+            self._name = "%s" % (self._t)
+            self._sources = list(self._s)
+            self._s = None
+        self._attached = set()
+
+        self._solutions = {}
+        self._igp_region = None
+        self._segments = {}
+        self._chains = {}
+        self._members = {}
+        self._entries = {}
+
+    @property
+    def name(self):
+        return self._name
+
+    @property
+    def sources(self):
+        return self._sources
+
+    def add_source(self, s):
+        """
+        Attach source s to the graph: add a vertex for s and its edges to
+        the routers s is connected to (see add_source_edges)
+        """
+        if (s in self._attached):
+            return
+        self._attached.add(s)
+        if (s not in self._sources):
+            self._sources.append(s)
+        self.add_vertex(s, subgraph=self._subnet_sub)
+        for router in self._net.routers.values():
+            if (s in router.subnets):
+                self.add_source_edges(router, s)
+
+        # Remembered solutions do not cover the new vertex
+        self._solutions = {}
+        self._igp_region = None
+
+    def add_source_edges(self, router, s):
+        pass
+
+    def copy(self):
+        g = super().copy()
+        g._sources = list(self._sources)
+        g._attached = set(self._attached)
+        g._segments = dict(self._segments)
+        g._chains = dict(self._chains)
+        g._members = dict(self._members)
+        g._entries = dict(self._entries)
+        g._solutions = dict(self._solutions)
+        return g
 
-    def has_path(self, failset=[]):
-        vertex = self.get_vertex(self._s)
-        return self.dfs(vertex, [], failset)
-
-    def dfs(self, vertex, visited, failset):
-        if (vertex == self.get_vertex(self._t)):
-            return True, [vertex]
-
-        if (vertex in visited):
+    def add_edge(self, src, dst, combine=False, color='black', style='solid',
+            label=None, headlabel='', taillabel=''):
+        """
+        Add an edge; an edge to a vertex that was contracted into a chain
+        (e.g., from a source attached after contract) leads to the chain's
+        vertex instead, entering the chain at that vertex, and its label
+        absorbs the labels along the rest of the chain
+        """
+        if (dst not in self._members):
+            return super().add_edge(src, dst, combine, color, style, label,
+                    headlabel, taillabel)
+        m, i = self._members[dst]
+        edge = super().add_edge(src, self.vertex_name(m), combine, color, 
+                style, Label.compose(label, self.chain_label(m, i)), 
+                headlabel, taillabel)
+        if (edge is None):
+            return None
+        edge.link = self.link_id(src, dst)
+        if (i > 0):
+            self._entries[(edge.src, m)] = i
+        return edge
+
+    def add_segment(self, vertex, table, source, target, prefix):
+        """
+        Record that vertex is the entry of a replica of an IGP layer, whose
+        best paths are found with table (see Segment)
+        """
+        self._segments[vertex] = Segment(table, source, target, prefix)
+        self._solutions = {}
+        self._igp_region = None
+
+    def source(self, source=None):
+        if (source is None):
+            if (self._s is None):
+                raise ValueError("TPG %s has several sources" % self._name)
+            return self._s
+        return source
+
+    def locate(self, name):
+        """
+        Vertex with the given name, or the vertex of the chain it was
+        contracted into, and its position in the chain (None if it was not
+        contracted)
+        """
+        if (name in self._members):
+            return self._members[name]
+        return self.get_vertex(name), None
+
+    def entry(self, u, m):
+        """
+        Position of the vertex at which an edge from u enters chain m
+        """
+        return self._entries.get((u, m), 0)
+
+    def expand(self, path, failset=frozenset()):
+        """
+        Names of the vertices on a path, including the vertices of the
+        chains (from the vertex the path enters them at) and IGP layer
+        replicas on it
+        """
+        names = []
+        for j, v in enumerate(path):
+            if (v in self._chains):
+                i = (0 if j == 0 else self.entry(path[j-1], v))
+                names.extend(self._chains[v].names[i:])
+            elif (v in self._segments):
+                names.extend(self._segments[v].names(failset))
+            else:
+                names.append(self.vertex_name(v))
+        return names
+
+    def has_path(self, failset=frozenset(), source=None):
+        vertex, i = self.locate(self.source(source))
+        if (i is not None 
+                and not failset.isdisjoint(self._chains[vertex].links[i:])):
             return False, []
-        visited.append(vertex)
+        found, path = self.dfs(vertex, self.get_vertex(self._t), failset)
+        return found, self.expand(path, failset)[(0 if i is None else i):]
+
+    def dfs(self, vertex, target, failset):
+        """
+        Depth-first search for a path from vertex to target that avoids
+        failed edges, using an explicit stack (so long paths do not exceed
+        the recursion limit)
+        """
+        if (vertex == target):
+            return True, [vertex]
 
-        for edge in self._graph.out_edges(vertex):
-            if (self.edge_has_failed(edge, failset)):
-                continue
-            found, subpath = self.dfs(edge[1], visited, failset)
-            if (found):
-                return found, [vertex] + subpath
+        visited = set([vertex])
+        path = [vertex]
+        stack = [iter(self.out_edges(vertex))]
+        while (len(stack) > 0):
+            for edge in stack[-1]:
+                if (self.edge_has_failed(edge, failset)):
+                    continue
+                if (edge.dst == target):
+                    return True, path + [target]
+                if (edge.dst in visited):
+                    continue
+                visited.add(edge.dst)
+                path.append(edge.dst)
+                stack.append(iter(self.out_edges(edge.dst)))
+                break
+            else:
+                stack.pop()
+                path.pop()
 
         return False, []
 
-    def edge_has_failed(self, edge, failset=[]):
-        src = str(edge[0]).split(':')[0]
-        dst = str(edge[1]).split(':')[0]
-        return ([src,dst] in failset or [dst,src] in failset)
+    def link_id(self, src, dst):
+        # Vertices of IGP layer replicas are named after the vertices they
+        # replicate, behind a "[router:vlan]" prefix
+        return config.Path.link(src.split(']')[-1].split(':')[0], 
+                dst.split(']')[-1].split(':')[0])
+
+    def edge_has_failed(self, edge, failset=frozenset()):
+        # An edge into a chain also traverses the links within the chain,
+        # and an edge out of an IGP layer replica's entry also traverses the
+        # replica
+        return (edge.link in failset or (edge.dst in self._chains
+                and not failset.isdisjoint(self._chains[edge.dst].links[
+                    self.entry(edge.src, edge.dst):]))
+                or (edge.src in self._segments
+                    and self._segments[edge.src].cost(failset) < 0))
+
+    def tpvp(self, verbose=False, failset=frozenset(), reprocess=False, 
+            worklist=False, dijkstra=False, source=None):
+        name = self.source(source)
+        bestpath, bestsign = self.solve(verbose, failset, worklist, dijkstra)
 
-    def tpvp(self, verbose=False, failset=[], reprocess=False):
-        # Line 2
-        path = {}
-        sign = {}
-        bestpath = {}
-        bestsign = {}
-        for u in self._graph.nodes():
-            path[u] = {}
-            sign[u] = {}
-            bestpath[u] = None
-            bestsign[u] = None
-            for v in self._graph.out_neighbors(u):
-                path[u][v] = None
-                sign[u][v] = None
+        if (reprocess):
+            realpath = []
+            while (name != self._t):
+                node_path, _ = self.best_path(name, failset, bestpath, 
+                        bestsign)
+                if (node_path is None):
+                    return (None, None)
+                head_path, name = self.get_head_and_next(node_path)
+                realpath += head_path
+            return (realpath + [self._t], {})
+        else:
+            return self.best_path(name, failset, bestpath, bestsign)
+
+    def best_path(self, name, failset, bestpath, bestsign):
+        """
+        Best path (as vertex names) and signature of the named vertex, given
+        the best paths and signatures of the (possibly contracted) graph
+        """
+        v, i = self.locate(name)
+        if (bestpath[v] is None):
+            return (None, (bestsign[v] if i is None else None))
+        if (i is None):
+            return (self.expand(bestpath[v].vertices(), failset), 
+                    bestsign[v])
+
+        # A vertex within a chain extends the path of the chain's last vertex
+        chain = self._chains[v]
+        if (not failset.isdisjoint(chain.links[i:])):
+            return (None, None)
+        sign = self.sign_combine(self.chain_label(v, i), bestsign[v])
+        if (sign is None):
+            return (None, None)
+        return (self.expand(bestpath[v].vertices(), failset)[i:], sign)
+
+    def solve(self, verbose=False, failset=frozenset(), worklist=False,
+            dijkstra=False):
+        """
+        Compute the best path and signature of every vertex, and remember
+        them so later queries with the same failset (e.g., from other
+        sources) reuse them. Verbose runs always solve, so every round is
+        printed.
+        """
+        key = (failset, worklist, dijkstra)
+        if (not verbose and key in self._solutions):
+            return self._solutions[key]
+
+        solution = self.run_tpvp(verbose, failset, worklist, dijkstra)
+
+        if (len(self._solutions) >= self.SOLUTION_CACHE_SIZE):
+            del self._solutions[next(iter(self._solutions))]
+        self._solutions[key] = solution
+        return solution
+
+    def run_tpvp(self, verbose=False, failset=frozenset(), worklist=False,
+            dijkstra=False):
+        # Line 2: paths are chains of PathNodes, so extending a neighbor's
+        # best path by one hop shares the neighbor's chain instead of
+        # copying it
+        n = self.num_vertices()
+        path = [None] * n
+        sign = [None] * n
+        bestpath = [None] * n
+        bestsign = [None] * n
 
         # Line 3
         dst = self.get_vertex(self._t)
-        bestpath[dst] = [dst]
-        bestsign[dst] = {'lp':100,'len':0,'cost':0,'tags':set()}
+        bestpath[dst] = PathNode(dst, None)
+        bestsign[dst] = Signature(lp=100, len=0, cost=0, tags=0)
+
+        # Vertices whose best path is already final are never re-ranked, and
+        # the entries of IGP layer replicas follow the best paths of their
+        # exits
+        if (dijkstra):
+            fixed = list(self.igp_region())
+            self.solve_igp(dst, failset, bestpath, bestsign, fixed)
+        else:
+            fixed = [False] * n
+            fixed[dst] = True
+        exits = {}
+        for u in self._segments:
+            fixed[u] = True
+            exits.setdefault(self.out_edges(u)[0].dst, []).append(u)
+            self.follow_segment(u, failset, bestpath, bestsign)
+
+        # Vertices that are not on any path from a source to the destination
+        # cannot be on a source's best path, and never affect the best paths
+        # of the vertices that are, so they are never ranked (see
+        # relevant_vertices); verbose runs rank every vertex, so every round
+        # shows every vertex's best path
+        if (not verbose):
+            relevant = self.relevant_vertices(dst, failset)
+            for u in self.vertices():
+                if (not relevant[u]):
+                    fixed[u] = True
+
+        ranked = [u for u in self.vertices() if not fixed[u]]
+        for u in ranked:
+            path[u] = {}
+            sign[u] = {}
+            for e in self.out_edges(u):
+                path[u][e.dst] = None
+                sign[u][e.dst] = None
 
-        change = True
-        i = 0
+        if (worklist):
+            self.tpvp_worklist(fixed, verbose, failset, path, sign, bestpath,
+                    bestsign, exits)
+        else:
+            change = True
+            i = 0
 
-        # Line 4
-        while change:
-            i += 1
+            # Line 4
+            while change:
+                i += 1
 
-            if (verbose):
-                print('ROUND %d' % i)
-                table = [[v, (None if bestpath[v] is None else
-                        ' > '.join(bestpath[v])),
-                        bestsign[v]] for v in sorted(bestpath.keys())]
-                print(tabulate(table, headers=["Node", "Best path to %s" % dst,
-                        "Best signature"]))
+                if (verbose):
+                    self.print_tpvp_round(i, bestpath, bestsign)
 
-            change = False
+                change = False
 
-            # Line 5
-            for u in self._graph.nodes():
+                # Line 5
+                for u in ranked:
 
-                if (u == dst): 
+                    # Lines 6-11
+                    if (len(self.tpvp_update(u, failset, path, sign, 
+                            bestpath, bestsign, exits)) > 0):
+                        change = True
+
+        return bestpath, bestsign
+
+    def prune_roots(self):
+        """
+        Vertices whose best paths are queried (see tpvp): the sources
+        """
+        return [self.locate(s)[0] for s in self._sources 
+                if (self.has_vertex(s) or s in self._members)]
+
+    def relevant_vertices(self, dst, failset=frozenset(), roots=None):
+        """
+        Determine which vertices are on a path from one of the roots
+        (default: the prune roots, see prune_roots) to dst that avoids failed
+        edges: the vertices reachable from a root that can also reach dst
+        """
+        n = self.num_vertices()
+        reached = [False] * n
+        stack = list(self.prune_roots() if roots is None else roots)
+        for u in stack:
+            reached[u] = True
+        while (len(stack) > 0):
+            u = stack.pop()
+            for e in self.out_edges(u):
+                if (not reached[e.dst] 
+                        and not self.edge_has_failed(e, failset)):
+                    reached[e.dst] = True
+                    stack.append(e.dst)
+
+        relevant = [False] * n
+        if (reached[dst]):
+            relevant[dst] = True
+            stack = [dst]
+        while (len(stack) > 0):
+            v = stack.pop()
+            for e in self.in_edges(v):
+                if (reached[e.src] and not relevant[e.src]
+                        and not self.edge_has_failed(e, failset)):
+                    relevant[e.src] = True
+                    stack.append(e.src)
+        return relevant
+
+    def core_links(self, failset=frozenset(), source=None):
+        """
+        Links traversed by some path from the source to the destination that
+        avoids failed edges. The best path of the source only depends on the
+        best paths of the vertices on such paths, so failing any other link
+        cannot change it.
+        """
+        vertex, i = self.locate(self.source(source))
+        links = set()
+        if (i is not None):
+            links.update(self._chains[vertex].links[i:])
+        relevant = self.relevant_vertices(self.get_vertex(self._t), failset,
+                [vertex])
+        for u in self.vertices():
+            if (not relevant[u]):
+                continue
+            for e in self.out_edges(u):
+                if (relevant[e.dst] and not self.edge_has_failed(e, failset)):
+                    links.add(e.link)
+                    if (e.dst in self._chains):
+                        links.update(self._chains[e.dst].links[
+                            self.entry(u, e.dst):])
+                    if (u in self._segments):
+                        links.update(self._segments[u].table.links)
+        links.discard(None)
+        return links
+
+    def igp_region(self):
+        """
+        Determine which vertices are in the IGP region: vertices that are
+        not BGP vertices, whose out edges only add cost, and whose out edges
+        only lead to other vertices in the region (or the destination). Only
+        cost matters for paths within the region, so the best paths of its
+        vertices can be computed with Dijkstra's algorithm (see solve_igp).
+        """
+        if (self._igp_region is not None):
+            return self._igp_region
+
+        n = self.num_vertices()
+        dst = self.get_vertex(self._t)
+        region = [False] * n
+        for u in self.vertices():
+            name = self.vertex_name(u)
+            region[u] = (u == dst or (name is not None 
+                    and "BGP" not in self.rank_name(u)
+                    and all([self.cost_only(e.label) 
+                        for e in self.out_edges(u)])))
+
+        # Remove vertices that can leave the region, and then their upstream
+        # neighbors, until no vertex can leave the region
+        pending = [u for u in self.vertices() if region[u] and u != dst
+                and not all([region[e.dst] for e in self.out_edges(u)])]
+        for u in pending:
+            region[u] = False
+        while (len(pending) > 0):
+            v = pending.pop()
+            for e in self.in_edges(v):
+                if (region[e.src] and e.src != dst):
+                    region[e.src] = False
+                    pending.append(e.src)
+
+        self._igp_region = region
+        return region
+
+    def cost_only(self, label):
+        return (label is None or (not label.blocks_all and label.lp is None 
+                and label.len == 0 and label.add_tags == 0 
+                and label.remove_tags == 0 and label.block_tags == 0))
+
+    def solve_igp(self, dst, failset, bestpath, bestsign, region):
+        """
+        Compute the best paths of the vertices in the IGP region with
+        Dijkstra's algorithm, preferring the fewest hops among least-cost
+        paths. Each vertex's path goes through its first out neighbor on
+        such a path. TPVP only compares costs at OSPF vertices; other
+        vertices in the region (e.g., VLAN vertices) keep the first path
+        they are offered, which need not be least-cost. The best paths, and
+        their costs, may therefore differ from TPVP's, not only when there
+        are equal-cost ties.
+        """
+        key = [None] * self.num_vertices()
+        key[dst] = (0, 0)
+        order = []
+        heap = [(0, 0, dst)]
+        while (len(heap) > 0):
+            cost, hops, v = heapq.heappop(heap)
+            if (key[v] != (cost, hops)):
+                continue
+            order.append(v)
+            for e in self.in_edges(v):
+                u = e.src
+                if (not region[u] or u == dst 
+                        or self.edge_has_failed(e, failset)):
+                    continue
+                ukey = (cost + (0 if e.label is None else e.label.cost), 
+                        hops + 1)
+                if (key[u] is None or ukey < key[u]):
+                    key[u] = ukey
+                    heapq.heappush(heap, ukey + (u,))
+
+        # A vertex's neighbors on its best path precede it in order
+        for u in order[1:]:
+            for e in self.out_edges(u):
+                v = e.dst
+                if (key[v] is None or self.edge_has_failed(e, failset)):
                     continue
+                if (key[u] == (key[v][0] 
+                        + (0 if e.label is None else e.label.cost),
+                        key[v][1] + 1)):
+                    bestpath[u] = PathNode(u, bestpath[v])
+                    bestsign[u] = self.sign_combine(e.label, bestsign[v])
+                    break
+
+    def follow_segment(self, u, failset, bestpath, bestsign):
+        """
+        Set the best path of the entry u of an IGP layer replica to its exit
+        followed by the exit's best path, with the cost of the best path
+        through the replica, and return the vertices whose best path changed,
+        i.e., u and any invalidated upstream neighbors (as in tpvp_update)
+        """
+        exit = self.out_edges(u)[0]
+        v = exit.dst
+        newbestpath = None
+        newbestsign = None
+        if (bestpath[v] is not None and not bestpath[v].contains(u)
+                and not self.edge_has_failed(exit, failset)):
+            newbestsign = self.sign_combine(exit.label, bestsign[v])
+        if (newbestsign is not None):
+            newbestpath = PathNode(u, bestpath[v])
+            newbestsign = newbestsign._replace(cost=newbestsign.cost 
+                    + self._segments[u].cost(failset))
+
+        if (newbestsign == bestsign[u] 
+                and PathNode.same(newbestpath, bestpath[u])):
+            return []
+        bestpath[u] = newbestpath
+        bestsign[u] = newbestsign
+
+        changed = [u]
+        for e in self.in_edges(u):
+            w = e.src
+            if (bestpath[w] is not None and bestpath[w].next.vertex == u):
+                bestpath[w] = None
+                bestsign[w] = None
+                changed.append(w)
+        return changed
+
+    def tpvp_worklist(self, fixed, verbose, failset, path, sign, bestpath,
+            bestsign, exits=None):
+        """
+        Run TPVP rounds that only re-rank vertices with a successor (or their
+        own best path) that changed since they were last ranked. Vertices
+        are still visited in the same order as a full round, so the result
+        matches the round-based solver. Fixed vertices are never re-ranked.
+        """
+        pending = [u for u in self.vertices() if not fixed[u]]
+        queued = set(pending)
+        i = 0
 
-                # Line 6
-                for e in self._graph.out_edges(u)[::-1]:
-#                    print("%s %s" % (e, e.attr["label"]))
-                    if self.edge_has_failed(e, failset):
+        while (len(pending) > 0):
+            i += 1
+
+            if (verbose):
+                self.print_tpvp_round(i, bestpath, bestsign)
+
+            later = set()
+            while (len(pending) > 0):
+                u = heapq.heappop(pending)
+                queued.discard(u)
+
+                dirty = []
+                for w in self.tpvp_update(u, failset, path, sign, bestpath,
+                        bestsign, exits):
+                    if (w != u):
+                        dirty.append(w)
+                    dirty.extend([e.src for e in self.in_edges(w)])
+
+                for w in dirty:
+                    if (fixed[w]):
                         continue
+                    # Vertices after u are still reached in this round
+                    if (w > u):
+                        if (w not in queued):
+                            heapq.heappush(pending, w)
+                            queued.add(w)
+                    else:
+                        later.add(w)
+
+            pending = list(later)
+            heapq.heapify(pending)
+            queued = later
+
+    def tpvp_update(self, u, failset, path, sign, bestpath, bestsign,
+            exits=None):
+        """
+        Re-rank vertex u (Lines 6-11 of TPVP) and return the vertices whose
+        best path changed, i.e., u and any invalidated upstream neighbors,
+        and the entries of IGP layer replicas exiting to them (see
+        follow_segment)
+        """
+        # Line 6
+        for e in self.out_edges(u)[::-1]:
+            if self.edge_has_failed(e, failset):
+                continue
 
-                    v = e[1]
+            v = e.dst
 
-                    if (bestpath[v] is not None and u not in bestpath[v]):
+            if (bestpath[v] is not None and not bestpath[v].contains(u)):
 
-                        # Line 7
-                        path[u][v] = [u] + bestpath[v]
+                # Line 7
+                path[u][v] = PathNode(u, bestpath[v])
 
-                        # Line 8
-                        L = {}
-                        if "label" in e.attr and e.attr["label"] != '':
-                            L = eval(e.attr["label"])
-                        sign[u][v] = self.sign_combine(L, bestsign[v])
+                # Line 8
+                sign[u][v] = self.sign_combine(e.label, bestsign[v])
 
-                        if (sign[u][v] == None):
-                            path[u][v] = None
+                if (sign[u][v] is None):
+                    path[u][v] = None
 
-                # Line 9
-                newbestpath, newbestsign = self.path_rank(u, path[u], sign[u],
-                        bestpath[u], bestsign[u])
+        # Line 9
+        newbestpath, newbestsign = self.path_rank(u, path[u], sign[u],
+                bestpath[u], bestsign[u])
 
-                # Line 10
-                if newbestpath != bestpath[u] or newbestsign != bestsign[u]:
+        # Line 10
+        if ((newbestsign is bestsign[u] or newbestsign == bestsign[u]) 
+                and PathNode.same(newbestpath, bestpath[u])):
+            return []
 
-#                    print("CHANGE: %s" % u)
-                    bestpath[u] = newbestpath
-                    bestsign[u] = newbestsign
+        bestpath[u] = newbestpath
+        bestsign[u] = newbestsign
 
-                    # Line 11
-                    change = True
+        # Line 11
+        changed = [u]
 
-                    # MODIFICATION: invalidate best path of upstream neighbors 
-                    # whose next hop is u
-                    for e in self._graph.in_edges(u):
-                        v = e[0]
-                        if bestpath[v] is not None and bestpath[v][1] == u:
-                            bestpath[v] = None
-                            bestsign[v] = None
+        # MODIFICATION: invalidate best path of upstream neighbors 
+        # whose next hop is u
+        for e in self.in_edges(u):
+            v = e.src
+            if bestpath[v] is not None and bestpath[v].next.vertex == u:
+                bestpath[v] = None
+                bestsign[v] = None
+                changed.append(v)
 
-        src = self.get_vertex(self._s)
-#        print(bestsign)
+        # Entries followed here are also checked for exits to follow
+        if (exits is None):
+            return changed
+        for w in changed:
+            for v in exits.get(w, []):
+                changed.extend(self.follow_segment(v, failset, bestpath,
+                        bestsign))
 
-        if (reprocess):
-            realpath = []
-            node = src
-            while (node != dst):
-                node_path = bestpath[node]
-                if (node_path is None):
-                    return (None, None)
-                head_path, node = self.get_head_and_next(node_path)
-                realpath += head_path
-            return (realpath + [dst], {})
-        else:
-            return (bestpath[src], bestsign[src])
+        return changed
+
+    def print_tpvp_round(self, i, bestpath, bestsign):
+        print('ROUND %d' % i)
+        table = [[self.vertex_name(v), (None if bestpath[v] is None 
+                else ' > '.join(self.path_names(bestpath[v].vertices()))),
+                (None if bestsign[v] is None else self.sign_str(bestsign[v]))]
+                for v in sorted(self.vertices(), key=self.vertex_name)]
+        print(tabulate(table, headers=["Node", "Best path to %s" % self._t,
+                "Best signature"]))
 
     def get_head_and_next(self, path):
         node = path[0]
@@ -513,23 +1758,33 @@ class TPG(Graph):
         return (head_path, None)
 
     def sign_combine(self, label, sign):
-        newsign = copy.deepcopy(sign)
-        for k,v in label.items():
-            if k == 'cost' or k == 'len':
-                newsign[k] = v + (newsign[k] if k in newsign else 0)
-            elif k == 'lp':
-                newsign[k] = v
-            elif k == 'at':
-                newsign['tags'].update(v)
-            elif k == 'rt':
-                newsign['tags'].difference_update(v)
-            elif k == 'bt':
-                if (len(newsign['tags'].intersection(v)) > 0):
-                    return None
-
-        return newsign
+        if (label is None):
+            return sign
+
+        if (label.blocks_all or sign.tags & label.block_tags):
+            return None
+
+        return Signature(lp=(sign.lp if label.lp is None else label.lp),
+                len=sign.len + label.len, cost=sign.cost + label.cost,
+                tags=(sign.tags & ~label.remove_tags) | label.add_tags)
+
+    def sign_str(self, sign):
+        if (not isinstance(sign, Signature)):
+            return str(sign)
+        return str({'lp' : sign.lp, 'len' : sign.len, 'cost' : sign.cost,
+                'tags' : set(self._net.tag_names(sign.tags))})
+
+    def rank_name(self, u):
+        """
+        Name that determines how a vertex ranks paths; a chain ranks paths
+        like its last vertex, the only one with a choice of next hop
+        """
+        if (u in self._chains):
+            return self._chains[u].names[-1]
+        return self.vertex_name(u)
 
     def path_rank(self, u, paths, signs, bestpath, bestsign):
+        name = self.rank_name(u)
         for v,sign in signs.items():
             if (sign is None):
                 continue
@@ -538,32 +1793,115 @@ class TPG(Graph):
                 bestsign = sign
                 bestpath = paths[v]
 
-            if ("OSPF" in str(u)):
-                if (sign['cost'] < bestsign['cost']):
+            if ("OSPF" in name):
+                if (sign.cost < bestsign.cost):
                     bestsign = sign
                     bestpath = paths[v]
-            elif ("BGP" in str(u)):
-                if (sign['lp'] > bestsign['lp']
-                        or (sign['lp'] == bestsign['lp']
-                            and sign['len'] < bestsign['len'])):
+            elif ("BGP" in name):
+                if (sign.lp > bestsign.lp
+                        or (sign.lp == bestsign.lp
+                            and sign.len < bestsign.len)):
                     bestsign = sign
                     bestpath = paths[v]
 
         return bestpath, bestsign
 
+    def chain_edge(self, u, dst):
+        """
+        Edge that links u to the next vertex in a chain: u's only out edge,
+        if it is also the only in edge of a vertex other than u and dst;
+        entries of IGP layer replicas are never part of a chain
+        """
+        if (self.out_degree(u) != 1 or u in self._segments):
+            return None
+        e = self.out_edges(u)[0]
+        if (e.dst == u or e.dst == dst or self.in_degree(e.dst) != 1
+                or e.dst in self._segments):
+            return None
+        return e
+
+    def chain_label(self, m, i=0):
+        """
+        Label equivalent to the labels along chain m from its i-th vertex to
+        its last vertex
+        """
+        label = None
+        for l in reversed(self._chains[m].labels[i:]):
+            label = Label.compose(l, label)
+        return label
+
     def contract(self):
-        for u in self._graph.nodes():
-            u_out = self._graph.out_edges(u)
-            if (len(u_out) == 1):
-                v = u_out[0][1]
-                if (self._graph.in_degree(v) == 1):
-                    v_out = self._graph.out_edges(v)
-                    print("\t%s - %s" % (u, v))
-                    uv = "%s-%s" % (u, v)
-                    self.add_vertex(uv)
-                    for e in self._graph.in_edges(u):
-                        self.add_edge(e[0], uv, label=e.attr["label"])
-                    for e in self._graph.out_edges(v):
-                        self.add_edge(uv, e[1], label=e.attr["label"])
-                    self._graph.remove_node(u)
-                    self._graph.remove_node(v)
+        """
+        Collapse each maximal chain of vertices, in which every edge is the
+        only out edge of its source and the only in edge of its destination,
+        into a single vertex, in one pass, and print the chains. A chain's
+        vertex keeps the in edges of its first vertex, whose labels absorb
+        the labels along the chain, and the out edges of its last vertex,
+        which it ranks paths like. has_path and tpvp search and solve the
+        contracted graph, and expand its paths back into the chains'
+        vertices.
+
+        TPVP depends on the order in which vertices pass paths on, which
+        contraction changes: a chain passes a path on in one step, rather
+        than one vertex per visit, and chains with equal-cost paths count as
+        one hop. A vertex may therefore keep a different one of several
+        equally good paths, or a different first path it was offered, than
+        it does in the graph as built. Reachability is unaffected.
+        """
+        self._solutions = {}
+        self._igp_region = None
+        dst = self.get_vertex(self._t)
+        for u in self.vertices():
+            if (self.vertex_name(u) is None):
+                continue
+
+            # Chains start at a vertex that is not linked to by its only in
+            # edge, so cycles are never contracted
+            if (self.chain_edge(u, dst) is None or (self.in_degree(u) == 1
+                    and self.chain_edge(self.in_edges(u)[0].src, dst) 
+                        is not None)):
+                continue
+            chain = [u]
+            edges = []
+            e = self.chain_edge(u, dst)
+            while (e is not None):
+                chain.append(e.dst)
+                edges.append(e)
+                e = self.chain_edge(e.dst, dst)
+
+            names = [self.vertex_name(v) for v in chain]
+            print("\t%s" % (' - '.join(names)))
+            name = '-'.join(names)
+            m = chain[-1]
+            self._chains[m] = Chain(names, [e.label for e in edges], 
+                    [e.link for e in edges])
+            for i, member in enumerate(names):
+                self._members[member] = (m, i)
+
+            # The chain's vertex takes over its last vertex's id. The labels
+            # along the chain are composed into the first vertex's in edges,
+            # and edges from the last vertex to itself or the first vertex
+            # become self loops.
+            prefix = self.chain_label(m)
+            ins = [(e.src, e.color, e.style, 
+                    Label.compose(e.label, prefix), e.link)
+                    for e in self.in_edges(chain[0]) if e.src != chain[-1]]
+            outs = []
+            for e in self.out_edges(chain[-1]):
+                if (e.dst == chain[0]):
+                    outs.append((m, e.color, e.style, 
+                            Label.compose(e.label, prefix), e.link))
+                else:
+                    outs.append((e.dst, e.color, e.style, e.label, e.link))
+            for v in chain:
+                self.remove_vertex(v)
+            self._names[m] = name
+            self._ids[name] = m
+            for src, color, style, label, link in ins:
+                edge = self.add_edge(self.vertex_name(src), name, 
+                        color=color, style=style, label=label)
+                edge.link = link
+            for w, color, style, label, link in outs:
+                edge = self.add_edge(name, self.vertex_name(w), 
+                        color=color, style=style, label=label)
+                edge.link = link
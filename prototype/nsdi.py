@@ -3,11 +3,10 @@
 import config
 import graph
 
-class RAG(graph.Graph):
-    def __init__(self, net, l2, subnet=None):
-        super().__init__(net)
+class RAG(graph.RAG):
+    def __init__(self, net, l2, subnets=[]):
+        super().__init__(net, subnets)
         self._l2 = l2
-        self._subnet = subnet
         self._ospf_sub = self.add_subgraph("ospf", color="forestgreen")
         self._bgp_sub = self.add_subgraph("bgp", color="orange")
         self._subnet_sub = self.add_subgraph("subnet", color="red")
@@ -17,7 +16,7 @@ class RAG(graph.Graph):
             if (router.bgp is not None):
                 self.add_vertex(self.bgp_name(router), subgraph=self._bgp_sub)
 
-        if (subnet is not None):
+        for subnet in self.subnets:
             self.add_vertex(subnet, subgraph=self._subnet_sub)
 
         for router in net.routers.values():
@@ -25,45 +24,14 @@ class RAG(graph.Graph):
                 self.add_ospf_adjacencies(router)
                 if ("bgp" in router.ospf.redistribute):
                     self.add_edge(self.bgp_name(router), self.ospf_name(router))
-                if (subnet in router.ospf.origins):
-                    self.add_edge(subnet, self.ospf_name(router), color="red")
+                self.add_origin_edges(router.ospf.origins, 
+                        self.ospf_name(router))
             if (router.bgp is not None):
                 self.add_bgp_adjacencies(router)
                 if ("ospf" in router.bgp.redistribute):
                     self.add_edge(self.ospf_name(router), self.bgp_name(router))
-                if (subnet in router.bgp.origins):
-                    self.add_edge(subnet, self.bgp_name(router), color="red")
-
-    def taint(self, verbose=False):
-        if (self._subnet is not None):
-            if (verbose):
-                print("Tainting %s..." % self._subnet)
-            vertex = self.get_vertex(self._subnet)
-            vertex.attr["color"] = "black"
-            self.propagate_taint(vertex, verbose=verbose)
-
-    def propagate_taint(self, vertex, noibgp=False, verbose=False):
-        if vertex.attr["color"] == "red":
-            return
-
-        vertex.attr["color"] = "red"
-        if (verbose):
-            print("\tTaint %s" % vertex)
-
-        for edge in self._graph.out_edges(vertex):
-            ibgp = (edge.attr["style"] == "dashed")
-            if (not (ibgp and noibgp)):
-                edge.attr["color"] = "red"
-                if (verbose):
-                    print("\tPropagate from %s to %s" % edge)
-                self.propagate_taint(edge[1], noibgp=ibgp, verbose=verbose)
-
-    def is_tainted(self, process):
-        if (type(process) is config.Ospf):
-            vertex_name = self.ospf_name(process.router)
-        elif (type(process) is config.Bgp):
-            vertex_name = self.bgp_name(process.router)
-        return (self.get_vertex(vertex_name).attr["color"] == "red")
+                self.add_origin_edges(router.bgp.origins, 
+                        self.bgp_name(router))
 
     def add_ospf_adjacencies(self, router):
         for vlan in router.ospf.active_vlans:
@@ -147,15 +115,11 @@ class RPG(graph.Graph):
     def add_ospf_to_vlan_edges(self, router):
         for vlan in router.ospf.active_vlans:
             self.add_edge(self.ospf_name(router), self.vlan_name(vlan),
-                    label={"cost":1})
+                    label=graph.Label(cost=1))
 
     def add_bgp_to_vlan_ospf_edges(self, router):
         for neighbor in router.bgp.neighbors:
-            matching_vlan = None
-            for vlan in router.vlans.values():
-                if neighbor.addr in vlan.addr.network:
-                    matching_vlan = vlan
-                    break
+            matching_vlan = neighbor.connected_vlan
             if (matching_vlan):
                 self.add_edge(self.bgp_name(neighbor), 
                         self.vlan_name(matching_vlan))
@@ -175,13 +139,13 @@ class RPG(graph.Graph):
                 self.add_edge(self._t, self.bgp_name(neighbor))
 
     def add_vlan_to_ospf_edges(self, router):
-        if (not self._rag.is_tainted(router.ospf)):
+        if (not self._rag.is_tainted(router.ospf, self._t)):
             return
         for vlan in router.vlans.values():
             self.add_edge(self.vlan_name(vlan), self.ospf_name(router))
 
     def add_vlan_to_bgp_edges(self, router):
-        if (not self._rag.is_tainted(router.bgp)):
+        if (not self._rag.is_tainted(router.bgp, self._t)):
             return
         for vlan in router.vlans.values():
             for neighbor in router.bgp.neighbors:
@@ -190,9 +154,9 @@ class RPG(graph.Graph):
     def add_vlan_to_subnet_edges(self, router):
         if (self._s in router.subnets
                 and ((router.ospf is not None 
-                        and self._rag.is_tainted(router.ospf))
+                        and self._rag.is_tainted(router.ospf, self._t))
                     or (router.bgp is not None 
-                        and self._rag.is_tainted(router.bgp)))):
+                        and self._rag.is_tainted(router.bgp, self._t)))):
             for vlan in router.vlans.values():
                 self.add_edge(self.vlan_name(vlan), self._s)
 
@@ -207,35 +171,54 @@ class RPG(graph.Graph):
         return "%s:BGP:%s" % (neighbor.bgp.router.name, 
                 neighbor.iface.router.name)
 
-    def has_path(self, failset=[]):
+    def has_path(self, failset=frozenset(), source=None):
         vertex = self.get_vertex(self._t)
-        return self.dfs(vertex, [], failset)
+        found, path = self.dfs(vertex, self.get_vertex(self._s), failset)
+        return found, self.path_names(path)
 
-    def dfs(self, vertex, visited, failset):
-        if (vertex == self.get_vertex(self._s)):
+    def dfs(self, vertex, target, failset):
+        """
+        Depth-first search for a path from vertex to target that avoids
+        failed edges, using an explicit stack
+        """
+        if (vertex == target):
             return True, [vertex]
 
-        if (vertex in visited):
-            return False, []
-        visited.append(vertex)
-
-        for edge in self._graph.out_edges(vertex):
-            if (self.edge_has_failed(edge, failset)):
-                continue
-            found, subpath = self.dfs(edge[1], visited, failset)
-            if (found):
-                return found, [vertex] + subpath
+        visited = set([vertex])
+        path = [vertex]
+        stack = [iter(self.out_edges(vertex))]
+        while (len(stack) > 0):
+            for edge in stack[-1]:
+                if (self.edge_has_failed(edge, failset)):
+                    continue
+                if (edge.dst == target):
+                    return True, path + [target]
+                if (edge.dst in visited):
+                    continue
+                visited.add(edge.dst)
+                path.append(edge.dst)
+                stack.append(iter(self.out_edges(edge.dst)))
+                break
+            else:
+                stack.pop()
+                path.pop()
 
         return False, []
 
-    def edge_has_failed(self, edge, failset=[]):
-        src = str(edge[0]).split(':')[0]
-        dst = str(edge[1]).split(':')[0]
-        return ([src,dst] in failset or [dst,src] in failset)
+    def link_id(self, src, dst):
+        return config.Path.link(src.split(':')[0], dst.split(':')[0])
 
-    def tpvp(self, verbose=False, failset=[], reprocess=False):
+    def edge_has_failed(self, edge, failset=frozenset()):
+        return (edge.link in failset)
+
+    def tpvp(self, verbose=False, failset=frozenset(), reprocess=False, 
+            worklist=False, dijkstra=False, source=None):
         return (None,None)
 
+    def core_links(self, failset=frozenset(), source=None):
+        # Without TPVP, no failure can change the best path
+        return set()
+
 class TPG(graph.TPG):
     def __init__(self, net, subnets, rag):
         super().__init__(net, subnets)
@@ -257,7 +240,6 @@ class TPG(graph.TPG):
 
         # Create special source and target vertices
         self.add_vertex(self._t, subgraph=self._subnet_sub)
-        self.add_vertex(self._s, subgraph=self._subnet_sub)
 
         # Create edges
         for router in net.routers.values():
@@ -265,13 +247,15 @@ class TPG(graph.TPG):
             self.add_vlan_to_subnet_edges(router)
             if (router.ospf is not None):
                 self.add_ospf_to_vlan_edges(router)
-                self.add_subnet_to_ospf_edges(router)
                 self.add_vlan_to_ospf_edges(router)
             if (router.bgp is not None):
                 self.add_bgp_to_vlan_ospf_edges(router)
-                self.add_subnet_to_bgp_edges(router)
                 self.add_vlan_to_bgp_edges(router)
 
+        # Attach sources
+        for s in self.sources:
+            self.add_source(s)
+
     def add_vlan_vertices(self, router):
         # Create a VLAN vertex per VLAN per router 
         for vlan in router.vlans.values():
@@ -300,22 +284,19 @@ class TPG(graph.TPG):
         # operates
         for vlan in router.ospf.active_vlans:
             self.add_edge(self.ospf_name(router), self.vlan_name(vlan),
-                    label={"cost":1})
+                    label=graph.Label(cost=1))
 
     def add_bgp_to_vlan_ospf_edges(self, router):
         # Create edge for each of a BGP process's neighbors
         for neighbor in router.bgp.neighbors:
-            matching_vlan = None
             # If neighbor can be reached using a connected route (i.e., VLAN),
             # then connect BGP vertex to corresponding VLAN vertex
-            for vlan in router.vlans.values():
-                if neighbor.addr in vlan.addr.network:
-                    matching_vlan = vlan
-                    break
+            matching_vlan = neighbor.connected_vlan
             if (matching_vlan):
                 self.add_edge(self.bgp_name(neighbor), 
                         self.vlan_name(matching_vlan), 
-                        label=neighbor.import_policy)
+                        label=graph.Label.create(neighbor.import_policy,
+                            self._net))
 #                if (neighbor.import_policy is not None):
 #                    print("%s->%s %s" % (self.bgp_name(neighbor), 
 #                        self.vlan_name(matching_vlan), neighbor.import_policy))
@@ -323,31 +304,36 @@ class TPG(graph.TPG):
             elif (router.ospf is not None):
                 self.add_edge(self.bgp_name(neighbor), 
                         self.ospf_name(router),
-                        label=neighbor.import_policy)
+                        label=graph.Label.create(neighbor.import_policy,
+                            self._net))
 #                if (neighbor.import_policy is not None):
 #                    print("%s->%s %s" % (self.bgp_name(neighbor), 
 #                        self.ospf_name(router), neighbor.import_policy))
 
-    def add_subnet_to_ospf_edges(self, router):
+    def add_source_edges(self, router, s):
+        if (router.ospf is not None):
+            self.add_subnet_to_ospf_edges(router, s)
+        if (router.bgp is not None):
+            self.add_subnet_to_bgp_edges(router, s)
+
+    def add_subnet_to_ospf_edges(self, router, s):
         # Connect source vertex to OSPF vertex on the same router, if OSPF 
         # process is tainted in the RAG
-        if (self._rag.is_tainted(router.ospf)
-                and self._s in router.subnets):
-            self.add_edge(self._s, self.ospf_name(router))
+        if (self._rag.is_tainted(router.ospf, self._t)):
+            self.add_edge(s, self.ospf_name(router))
 
-    def add_subnet_to_bgp_edges(self, router):
+    def add_subnet_to_bgp_edges(self, router, s):
         # Connect source vertex to BGP vertex on the same router, if BGP
         # process is tainted in the RAG
-        if (self._rag.is_tainted(router.bgp)
-                and self._s in router.subnets):
+        if (self._rag.is_tainted(router.bgp, self._t)):
             for neighbor in router.bgp.neighbors:
-                self.add_edge(self._s, self.bgp_name(neighbor))
+                self.add_edge(s, self.bgp_name(neighbor))
                 break
 
     def add_vlan_to_ospf_edges(self, router):
         # Connect VLAN vertices to OSPF vertex on the same router, if OSPF
         # process is tainted in the RAG
-        if (not self._rag.is_tainted(router.ospf)):
+        if (not self._rag.is_tainted(router.ospf, self._t)):
             return
         for vlan in router.vlans.values():
             self.add_edge(self.vlan_name(vlan), self.ospf_name(router))
@@ -355,7 +341,7 @@ class TPG(graph.TPG):
     def add_vlan_to_bgp_edges(self, router):
         # Connect VLAN vertices to BGP vertex on the same router, if BGP
         # process is tainted in the RAG
-        if (not self._rag.is_tainted(router.bgp)):
+        if (not self._rag.is_tainted(router.bgp, self._t)):
             return
         for vlan in router.vlans.values():
             for neighbor in router.bgp.neighbors:
@@ -366,11 +352,11 @@ class TPG(graph.TPG):
         # Connect VLAN vertices to target vertex on the same router, if OSPF
         # or BGP process originates a route and is tainted in the RAG
         if ((router.ospf is not None 
-                and self._rag.is_tainted(router.ospf)
+                and self._rag.is_tainted(router.ospf, self._t)
                 and self._t in router.ospf.origins
                 and self._t in router.subnets)
             or (router.bgp is not None 
-                and self._rag.is_tainted(router.bgp)
+                and self._rag.is_tainted(router.bgp, self._t)
                 and self._t in router.bgp.origins
                 and self._t in router.subnets)):
             for vlan in router.vlans.values():
@@ -407,21 +393,22 @@ class TPGMod(graph.TPG):
                 self.add_bgp_vertices(router)
 
         self.add_vertex(self._t, subgraph=self._subnet_sub)
-        self.add_vertex(self._s, subgraph=self._subnet_sub)
 
         for router in net.routers.values():
             self.add_vlan_to_vlan_edges(router)
             self.add_vlan_to_subnet_edges(router)
             if (router.ospf is not None):
                 self.add_ospf_to_vlan_edges(router)
-                self.add_subnet_to_ospf_edges(router)
                 self.add_vlan_to_ospf_edges(router)
             if (router.bgp is not None):
                 #self.add_bgp_intraprocess_edges(router)
                 self.add_bgp_to_vlan_ospf_edges(router)
-                self.add_subnet_to_bgp_edges(router)
                 self.add_vlan_to_bgp_edges(router)
 
+        # Attach sources
+        for s in self.sources:
+            self.add_source(s)
+
     def add_vlan_vertices(self, router):
         """
         For each of a router's VLANs, create an incoming VLAN vertex and
@@ -450,7 +437,8 @@ class TPGMod(graph.TPG):
         """
         for neighbor in router.bgp.neighbors:
             self.add_edge(self.bgp_name(router), self.bgp_name(neighbor),
-                    label=neighbor.import_policy)
+                    label=graph.Label.create(neighbor.import_policy,
+                            self._net))
             if (neighbor.import_policy is not None):
                 print("%s->%s %s" % (self.bgp_name(router), 
                         self.bgp_name(neighbor), neighbor.import_policy))
@@ -466,7 +454,7 @@ class TPGMod(graph.TPG):
     def add_ospf_to_vlan_edges(self, router):
         for vlan in router.ospf.active_vlans:
             self.add_edge(self.ospf_name(router), self.vlan_name(vlan, "O"),
-                    label={"cost":1})
+                    label=graph.Label(cost=1))
 
     def add_bgp_to_vlan_ospf_edges(self, router):
         """
@@ -475,38 +463,40 @@ class TPGMod(graph.TPG):
         neighbor is not reachable via connected route)
         """
         for neighbor in router.bgp.neighbors:
-            matching_vlan = None
-            for vlan in router.vlans.values():
-                if neighbor.addr in vlan.addr.network:
-                    matching_vlan = vlan
-                    break
+            matching_vlan = neighbor.connected_vlan
             if (matching_vlan):
                 self.add_edge(self.bgp_name(router),
                         self.vlan_name(matching_vlan, "O"),
-                        label=neighbor.import_policy)
+                        label=graph.Label.create(neighbor.import_policy,
+                            self._net))
             elif (router.ospf is not None):
                 self.add_edge(self.bgp_name(router),
                         self.ospf_name(router),
-                        label=neighbor.import_policy)
+                        label=graph.Label.create(neighbor.import_policy,
+                            self._net))
 
-    def add_subnet_to_ospf_edges(self, router):
-        if (self._rag.is_tainted(router.ospf)
-                and self._s in router.subnets):
-            self.add_edge(self._s, self.ospf_name(router))
+    def add_source_edges(self, router, s):
+        if (router.ospf is not None):
+            self.add_subnet_to_ospf_edges(router, s)
+        if (router.bgp is not None):
+            self.add_subnet_to_bgp_edges(router, s)
 
-    def add_subnet_to_bgp_edges(self, router):
+    def add_subnet_to_ospf_edges(self, router, s):
+        if (self._rag.is_tainted(router.ospf, self._t)):
+            self.add_edge(s, self.ospf_name(router))
+
+    def add_subnet_to_bgp_edges(self, router, s):
         """
         If the source (S) is connected to the router and the router's BGP
         process may learn a route to the destination (indicated by the
-        router's BGP vertex in the RAG being tainted), then connect source (S)
-        to the "incoming" BGP vertex for the router
+        router's BGP vertex in the RAG being tainted), then connect the source
+        (S) to the "incoming" BGP vertex for the router
         """
-        if (self._rag.is_tainted(router.bgp)
-                and self._s in router.subnets):
-            self.add_edge(self._s, self.bgp_name(router))
+        if (self._rag.is_tainted(router.bgp, self._t)):
+            self.add_edge(s, self.bgp_name(router))
 
     def add_vlan_to_ospf_edges(self, router):
-        if (not self._rag.is_tainted(router.ospf)):
+        if (not self._rag.is_tainted(router.ospf, self._t)):
             return
         for vlan in router.vlans.values():
             self.add_edge(self.vlan_name(vlan, "I"), self.ospf_name(router))
@@ -518,7 +508,7 @@ class TPGMod(graph.TPG):
         connect all of the router's VLAN vertices to the "incoming" BGP vertex
         for the router
         """
-        if (not self._rag.is_tainted(router.bgp)):
+        if (not self._rag.is_tainted(router.bgp, self._t)):
             return
         for vlan in router.vlans.values():
             self.add_edge(self.vlan_name(vlan, "I"), self.bgp_name(router))
@@ -526,10 +516,10 @@ class TPGMod(graph.TPG):
     def add_vlan_to_subnet_edges(self, router):
         if (self._t in router.subnets and
                 ((router.ospf is not None
-                    and self._rag.is_tainted(router.ospf)
+                    and self._rag.is_tainted(router.ospf, self._t)
                     and self._t in router.ospf.origins)
                 or (router.bgp is not None
-                    and self._rag.is_tainted(router.bgp)
+                    and self._rag.is_tainted(router.bgp, self._t)
                     and self._t in router.bgp.origins))):
             for vlan in router.vlans.values():
                 self.add_edge(self.vlan_name(vlan, "I"), self._t)
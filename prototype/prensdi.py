@@ -145,12 +145,12 @@ class RPG(graph.Graph):
 
     def was_tainted_by_adjacency(self, vlan):
         vertex = self.get_vertex(self.ospf_name(vlan))
-        for edge in self._graph.in_edges(vertex):
-            routerA = edge[0].split(':')[0]
-            routerB = edge[1].split(':')[0]
+        for edge in self.in_edges(vertex):
+            routerA = self.vertex_name(edge.src).split(':')[0]
+            routerB = self.vertex_name(edge.dst).split(':')[0]
             if (routerA == routerB):
                 continue
-            if (edge.attr["color"] == "red" and edge.attr["style"] != "dashed"):
+            if (edge.color == "red" and edge.style != "dashed"):
                 return True
         return False
 
@@ -166,28 +166,44 @@ class RPG(graph.Graph):
     def taint(self):
         if (self._t is not None):
             vertex = self.get_vertex(self._t)
-            vertex.attr["color"] = "black"
+            self.set_vertex_color(vertex, "black")
             self.propagate_taint(vertex)
 
     def propagate_taint(self, vertex, noibgp=False, nolateral=False):
-        if vertex.attr["color"] == "red":
+        """
+        Taint the vertices reachable from vertex, depth first, using an
+        explicit stack; each stack entry holds a tainted vertex, the
+        restrictions under which it was reached, and its remaining edges
+        """
+        if self.vertex_color(vertex) == "red":
             return
 
-        vertex.attr["color"] = "red"
-
-        for edge in self._graph.out_edges(vertex):
-            ibgp = (edge.attr["style"] == "dotted")
-            ospf = (("OSPF" in edge[0]) and ("OSPF" in edge[1])) 
-            routerA = edge[0].split(':')[0] 
-            routerB = edge[1].split(':')[0] 
-            intradevice = (routerA == routerB)
-            lateral = (ospf and not intradevice)
-            dependency = (edge.attr["style"] == "dashed")
-            if ((not (ibgp and noibgp))
-                and (not (lateral and nolateral))):
-                edge.attr["color"] = "red"
-                self.propagate_taint(edge[1], ibgp or (noibgp and intradevice), 
-                        nolateral or dependency)
+        self.set_vertex_color(vertex, "red")
+        stack = [(noibgp, nolateral, iter(self.out_edges(vertex)))]
+        while (len(stack) > 0):
+            noibgp, nolateral, edges = stack[-1]
+            for edge in edges:
+                src = self.vertex_name(edge.src)
+                dst = self.vertex_name(edge.dst)
+                ibgp = (edge.style == "dotted")
+                ospf = (("OSPF" in src) and ("OSPF" in dst))
+                routerA = src.split(':')[0]
+                routerB = dst.split(':')[0]
+                intradevice = (routerA == routerB)
+                lateral = (ospf and not intradevice)
+                dependency = (edge.style == "dashed")
+                if ((not (ibgp and noibgp))
+                    and (not (lateral and nolateral))):
+                    edge.color = "red"
+                    if self.vertex_color(edge.dst) == "red":
+                        continue
+                    self.set_vertex_color(edge.dst, "red")
+                    stack.append((ibgp or (noibgp and intradevice),
+                            nolateral or dependency,
+                            iter(self.out_edges(edge.dst))))
+                    break
+            else:
+                stack.pop()
 
 class RPGMod(graph.Graph):
     def __init__(self, net, l2, subnets=None):
@@ -308,12 +324,12 @@ class RPGMod(graph.Graph):
 
     def was_tainted_by_adjacency(self, vlan):
         vertex = self.get_vertex(self.ospf_name(vlan))
-        for edge in self._graph.in_edges(vertex):
-            routerA = edge[0].split(':')[0]
-            routerB = edge[1].split(':')[0]
+        for edge in self.in_edges(vertex):
+            routerA = self.vertex_name(edge.src).split(':')[0]
+            routerB = self.vertex_name(edge.dst).split(':')[0]
             if (routerA == routerB):
                 continue
-            if (edge.attr["color"] == "red" and edge.attr["style"] != "dashed"):
+            if (edge.color == "red" and edge.style != "dashed"):
                 return True
         return False
 
@@ -329,28 +345,44 @@ class RPGMod(graph.Graph):
     def taint(self):
         if (self._t is not None):
             vertex = self.get_vertex(self._t)
-            vertex.attr["color"] = "black"
+            self.set_vertex_color(vertex, "black")
             self.propagate_taint(vertex)
 
     def propagate_taint(self, vertex, noibgp=False, nolateral=False):
-        if vertex.attr["color"] == "red":
+        """
+        Taint the vertices reachable from vertex, depth first, using an
+        explicit stack; each stack entry holds a tainted vertex, the
+        restrictions under which it was reached, and its remaining edges
+        """
+        if self.vertex_color(vertex) == "red":
             return
 
-        vertex.attr["color"] = "red"
-
-        for edge in self._graph.out_edges(vertex):
-            ibgp = (edge.attr["style"] == "dotted")
-            ospf = (("OSPF" in edge[0]) and ("OSPF" in edge[1]))
-            routerA = edge[0].split(':')[0]
-            routerB = edge[1].split(':')[0]
-            intradevice = (routerA == routerB)
-            lateral = (ospf and not intradevice)
-            dependency = (edge.attr["style"] == "dashed")
-            if ((not (ibgp and noibgp))
-                and (not (lateral and nolateral))):
-                edge.attr["color"] = "red"
-                self.propagate_taint(edge[1], ibgp or (noibgp and intradevice),
-                        nolateral or dependency)
+        self.set_vertex_color(vertex, "red")
+        stack = [(noibgp, nolateral, iter(self.out_edges(vertex)))]
+        while (len(stack) > 0):
+            noibgp, nolateral, edges = stack[-1]
+            for edge in edges:
+                src = self.vertex_name(edge.src)
+                dst = self.vertex_name(edge.dst)
+                ibgp = (edge.style == "dotted")
+                ospf = (("OSPF" in src) and ("OSPF" in dst))
+                routerA = src.split(':')[0]
+                routerB = dst.split(':')[0]
+                intradevice = (routerA == routerB)
+                lateral = (ospf and not intradevice)
+                dependency = (edge.style == "dashed")
+                if ((not (ibgp and noibgp))
+                    and (not (lateral and nolateral))):
+                    edge.color = "red"
+                    if self.vertex_color(edge.dst) == "red":
+                        continue
+                    self.set_vertex_color(edge.dst, "red")
+                    stack.append((ibgp or (noibgp and intradevice),
+                            nolateral or dependency,
+                            iter(self.out_edges(edge.dst))))
+                    break
+            else:
+                stack.pop()
 
 class TPG(graph.TPG):
     def __init__(self, net, rpg, subnets):
@@ -386,21 +418,23 @@ class TPG(graph.TPG):
                     self.add_bgp_to_dst_edges(router)
 
     def add_vertices_based_on_taints(self):
-        for vertex in self._rpg._graph.nodes():
+        for vertex in self._rpg.vertices():
             # Ignore untainted vertices
-            if vertex.attr["color"] != "red":
+            if self._rpg.vertex_color(vertex) != "red":
                 continue
 
-            if vertex.attr["fontcolor"] == "purple":
-                self.add_vertex(vertex, subgraph=self._switch_sub)
-            elif vertex.attr["fontcolor"] == "orange":
-                self.add_vertex("%s:I" % vertex, subgraph=self._bgp_sub)
-                self.add_vertex("%s:O" % vertex, subgraph=self._bgp_sub)
-            elif vertex.attr["fontcolor"] == "forestgreen":
-                self.add_vertex("%s:I" % vertex, subgraph=self._ospf_sub)
-                self.add_vertex("%s:O" % vertex, subgraph=self._ospf_sub)
-            elif vertex.attr["fontcolor"] == "red":
-                self.add_vertex(vertex, subgraph=self._subnet_sub)
+            name = self._rpg.vertex_name(vertex)
+            fontcolor = self._rpg.vertex_fontcolor(vertex)
+            if fontcolor == "purple":
+                self.add_vertex(name, subgraph=self._switch_sub)
+            elif fontcolor == "orange":
+                self.add_vertex("%s:I" % name, subgraph=self._bgp_sub)
+                self.add_vertex("%s:O" % name, subgraph=self._bgp_sub)
+            elif fontcolor == "forestgreen":
+                self.add_vertex("%s:I" % name, subgraph=self._ospf_sub)
+                self.add_vertex("%s:O" % name, subgraph=self._ospf_sub)
+            elif fontcolor == "red":
+                self.add_vertex(name, subgraph=self._subnet_sub)
 
     def add_vlan_adjacencies(self, router):
         for vlan in router.vlans.values():
@@ -476,27 +510,27 @@ class TPG(graph.TPG):
                         and self.has_vertex(self.ospf_name(adjacent, "I"))):
                     self.add_edge(self.ospf_name(vlan, "O"), 
                             self.ospf_name(adjacent, "I"), color="forestgreen",
-                            label={"cost":1})
+                            label=graph.Label(cost=1))
 
     def add_bgp_adjacencies(self, router):
         for neighbor in router.bgp.neighbors:
-            for vlan in router.vlans.values():
-                if neighbor.addr not in vlan.addr.network:
-                    continue
-                if not self.has_vertex(self.bgp_name(vlan, "O")):
-                    continue
-                for iface in vlan.ifaces:
-                    if ((iface.neighbor.router == neighbor.iface.router)
-                            and self.has_vertex(
-                                self.bgp_name(neighbor.iface, "I"))):
-                        self.add_edge(self.bgp_name(vlan, "O"),
-                                self.bgp_name(neighbor.iface, "I"),
-                                combine=False, color="orange", 
-                                label=neighbor.import_policy)
-                        if (neighbor.import_policy is not None):
-                            print("%s->%s %s" % (self.bgp_name(vlan, "O"), 
-                                self.bgp_name(neighbor.iface, "I"), 
-                                neighbor.import_policy))
+            vlan = neighbor.connected_vlan
+            if (vlan is None
+                    or not self.has_vertex(self.bgp_name(vlan, "O"))):
+                continue
+            for iface in vlan.ifaces:
+                if ((iface.neighbor.router == neighbor.iface.router)
+                        and self.has_vertex(
+                            self.bgp_name(neighbor.iface, "I"))):
+                    self.add_edge(self.bgp_name(vlan, "O"),
+                            self.bgp_name(neighbor.iface, "I"),
+                            combine=False, color="orange", 
+                            label=graph.Label.create(
+                                neighbor.import_policy, self._net))
+                    if (neighbor.import_policy is not None):
+                        print("%s->%s %s" % (self.bgp_name(vlan, "O"), 
+                            self.bgp_name(neighbor.iface, "I"), 
+                            neighbor.import_policy))
 
 
     def add_src_to_ospf_edges(self, router):
@@ -567,21 +601,23 @@ class TPGMod(graph.TPG):
                     self.add_bgp_to_dst_edges(router)
 
     def add_vertices_based_on_taints(self):
-        for vertex in self._rpg._graph.nodes():
+        for vertex in self._rpg.vertices():
             # Ignore untainted vertices
-            if vertex.attr["color"] != "red":
+            if self._rpg.vertex_color(vertex) != "red":
                 continue
 
-            if vertex.attr["fontcolor"] == "purple":
-                self.add_vertex(vertex, subgraph=self._switch_sub)
-            elif vertex.attr["fontcolor"] == "orange":
-                self.add_vertex("%s:I" % vertex, subgraph=self._bgp_sub)
-                self.add_vertex("%s:O" % vertex, subgraph=self._bgp_sub)
-            elif vertex.attr["fontcolor"] == "forestgreen":
-                self.add_vertex("%s:I" % vertex, subgraph=self._ospf_sub)
-                self.add_vertex("%s:O" % vertex, subgraph=self._ospf_sub)
-            elif vertex.attr["fontcolor"] == "red":
-                self.add_vertex(vertex, subgraph=self._subnet_sub)
+            name = self._rpg.vertex_name(vertex)
+            fontcolor = self._rpg.vertex_fontcolor(vertex)
+            if fontcolor == "purple":
+                self.add_vertex(name, subgraph=self._switch_sub)
+            elif fontcolor == "orange":
+                self.add_vertex("%s:I" % name, subgraph=self._bgp_sub)
+                self.add_vertex("%s:O" % name, subgraph=self._bgp_sub)
+            elif fontcolor == "forestgreen":
+                self.add_vertex("%s:I" % name, subgraph=self._ospf_sub)
+                self.add_vertex("%s:O" % name, subgraph=self._ospf_sub)
+            elif fontcolor == "red":
+                self.add_vertex(name, subgraph=self._subnet_sub)
 
     def add_vlan_adjacencies(self, router):
         for vlan in router.vlans.values():
@@ -647,27 +683,27 @@ class TPGMod(graph.TPG):
                         and self.has_vertex(self.ospf_name(adjacent, "I"))):
                     self.add_edge(self.ospf_name(vlan, "O"),
                             self.ospf_name(adjacent, "I"), color="forestgreen",
-                            label={"cost":1})
+                            label=graph.Label(cost=1))
 
     def add_bgp_adjacencies(self, router):
         for neighbor in router.bgp.neighbors:
-            for vlan in router.vlans.values():
-                if neighbor.addr not in vlan.addr.network:
-                    continue
-                if not self.has_vertex(self.bgp_name(router, "O")):
-                    continue
-                for iface in vlan.ifaces:
-                    if ((iface.neighbor.router == neighbor.iface.router)
-                            and self.has_vertex(
-                                self.bgp_name(neighbor.iface.router, "I"))):
-                        self.add_edge(self.bgp_name(router, "O"),
-                                self.bgp_name(neighbor.iface.router, "I"),
-                                combine=False, color="orange",
-                                label=neighbor.import_policy)
-                        if (neighbor.import_policy is not None):
-                            print("%s->%s %s" % (self.bgp_name(router, "O"),
-                                self.bgp_name(neighbor.iface.router, "I"),
-                                neighbor.import_policy))
+            vlan = neighbor.connected_vlan
+            if (vlan is None
+                    or not self.has_vertex(self.bgp_name(router, "O"))):
+                continue
+            for iface in vlan.ifaces:
+                if ((iface.neighbor.router == neighbor.iface.router)
+                        and self.has_vertex(
+                            self.bgp_name(neighbor.iface.router, "I"))):
+                    self.add_edge(self.bgp_name(router, "O"),
+                            self.bgp_name(neighbor.iface.router, "I"),
+                            combine=False, color="orange",
+                            label=graph.Label.create(
+                                neighbor.import_policy, self._net))
+                    if (neighbor.import_policy is not None):
+                        print("%s->%s %s" % (self.bgp_name(router, "O"),
+                            self.bgp_name(neighbor.iface.router, "I"),
+                            neighbor.import_policy))
 
     def add_src_to_ospf_edges(self, router):
         for vlan in router.vlans.values():
@@ -3,11 +3,10 @@
 import config
 import graph
 
-class RAG(graph.Graph):
-    def __init__(self, net, l2, subnet=None):
-        super().__init__(net)
+class RAG(graph.RAG):
+    def __init__(self, net, l2, subnets=[]):
+        super().__init__(net, subnets)
         self._l2 = l2
-        self._subnet = subnet
         self._ospf_sub = self.add_subgraph("ospf", color="forestgreen")
         self._bgp_sub = self.add_subgraph("bgp", color="orange")
         self._subnet_sub = self.add_subgraph("subnet", color="red")
@@ -17,7 +16,7 @@ class RAG(graph.Graph):
             if (router.bgp is not None):
                 self.add_vertex(self.bgp_name(router), subgraph=self._bgp_sub)
 
-        if (subnet is not None):
+        for subnet in self.subnets:
             self.add_vertex(subnet, subgraph=self._subnet_sub)
 
         for router in net.routers.values():
@@ -25,45 +24,14 @@ class RAG(graph.Graph):
                 self.add_ospf_adjacencies(router)
                 if ("bgp" in router.ospf.redistribute):
                     self.add_edge(self.bgp_name(router), self.ospf_name(router))
-                if (subnet in router.ospf.origins):
-                    self.add_edge(subnet, self.ospf_name(router), color="red")
+                self.add_origin_edges(router.ospf.origins, 
+                        self.ospf_name(router))
             if (router.bgp is not None):
                 self.add_bgp_adjacencies(router)
                 if ("ospf" in router.bgp.redistribute):
                     self.add_edge(self.ospf_name(router), self.bgp_name(router))
-                if (subnet in router.bgp.origins):
-                    self.add_edge(subnet, self.bgp_name(router), color="red")
-
-    def taint(self, verbose=False):
-        if (self._subnet is not None):
-            if (verbose):
-                print("Tainting %s..." % self._subnet)
-            vertex = self.get_vertex(self._subnet)
-            vertex.attr["color"] = "black"
-            self.propagate_taint(vertex, verbose=verbose)
-
-    def propagate_taint(self, vertex, noibgp=False, verbose=False):
-        if vertex.attr["color"] == "red":
-            return
-
-        vertex.attr["color"] = "red"
-        if (verbose):
-            print("\tTaint %s" % vertex)
-
-        for edge in self._graph.out_edges(vertex):
-            ibgp = (edge.attr["style"] == "dashed")
-            if (not (ibgp and noibgp)):
-                edge.attr["color"] = "red"
-                if (verbose):
-                    print("\tPropagate from %s to %s" % edge)
-                self.propagate_taint(edge[1], noibgp=ibgp, verbose=verbose)
-
-    def is_tainted(self, process):
-        if (type(process) is config.Ospf):
-            vertex_name = self.ospf_name(process.router)
-        elif (type(process) is config.Bgp):
-            vertex_name = self.bgp_name(process.router)
-        return (self.get_vertex(vertex_name).attr["color"] == "red")
+                self.add_origin_edges(router.bgp.origins, 
+                        self.bgp_name(router))
 
     def add_ospf_adjacencies(self, router):
         for vlan in router.ospf.active_vlans:
@@ -88,11 +56,68 @@ class RAG(graph.Graph):
     def bgp_name(self, router):
         return "%s:BGP" % (router.name)
 
+class IgpLayer(graph.Graph):
+    """
+    IGP layer (VLAN and OSPF vertices) of a network, which TPGs replicate for
+    each BGP next hop that is reached via OSPF. The layer is the same for
+    every destination, so one layer, and the table of paths through it (see
+    graph.IgpTable), is shared by all of a network's TPGs and replicas.
+    """
+    def __init__(self, net):
+        super().__init__(net)
+        self._ospf_sub = self.add_subgraph("ospf", color="forestgreen")
+        self._vlan_sub = self.add_subgraph("vlan", color="blue")
+
+        for router in net.routers.values():
+            for vlan in router.vlans.values():
+                self.add_vertex(self.vlan_name(vlan, "I"), 
+                        subgraph=self._vlan_sub)
+                self.add_vertex(self.vlan_name(vlan, "O"), 
+                        subgraph=self._vlan_sub)
+            if (router.ospf is not None):
+                self.add_vertex(self.ospf_name(router), 
+                        subgraph=self._ospf_sub)
+
+        cost = graph.Label(cost=1)
+        for router in net.routers.values():
+            for vlan in router.vlans.values():
+                self.add_edge(self.vlan_name(vlan, "I"), 
+                        self.vlan_name(vlan, "O"))
+                for iface in vlan.ifaces:
+                    self.add_edge(self.vlan_name(vlan, "O"),
+                            self.vlan_name(iface.neighbor.vlan, "I"))
+            if (router.ospf is not None):
+                for vlan in router.ospf.active_vlans:
+                    self.add_edge(self.ospf_name(router), 
+                            self.vlan_name(vlan, "O"), label=cost)
+                for vlan in router.vlans.values():
+                    self.add_edge(self.vlan_name(vlan, "I"), 
+                            self.ospf_name(router))
+
+        self._table = graph.IgpTable(self)
+
+    @property
+    def table(self):
+        return self._table
+
+    def link_id(self, src, dst):
+        return config.Path.link(src.split(':')[0], dst.split(':')[0])
+
+    def is_ospf(self, v):
+        return (self._vertex_subs[v] is self._ospf_sub)
+
+    def vlan_name(self, vlan, direction):
+        return "%s:VLAN:%s:%s" % (vlan.router.name, vlan.num, direction)
+
+    def ospf_name(self, router):
+        return "%s:OSPF" % (router.name)
+
 class TPG(graph.TPG):
-    def __init__(self, net, subnets, rag):
+    def __init__(self, net, subnets, rag, igp=None):
         super().__init__(net, subnets)
 
         self._rag = rag
+        self._igp = igp
 
         self._subnet_sub = self.add_subgraph("subnet", color="red")
         self._bgp_sub = self.add_subgraph("bgp", color="orange")
@@ -111,12 +136,10 @@ class TPG(graph.TPG):
                 self.add_bgp_vertices(router)
 
         self.add_vertex(self._t, subgraph=self._subnet_sub)
-        self.add_vertex(self._s, subgraph=self._subnet_sub)
 
         for router in net.routers.values():
             self.add_vlan_to_vlan_edges(router)
             self.add_vlan_to_rib_edges(router)
-            self.add_subnet_to_rib_edges(router)
             if (router.ospf is not None):
                 self.add_ospf_to_vlan_edges(router)
                 self.add_ospf_to_subnet_edges(router)
@@ -127,24 +150,21 @@ class TPG(graph.TPG):
                 self.add_bgp_to_subnet_edges(router)
                 self.add_rib_to_bgp_edges(router)
 
-    def add_vlan_vertices(self, router, subgraph=None, name_prefix=""):
+        # Attach sources
+        for s in self.sources:
+            self.add_source(s)
+
+    def add_vlan_vertices(self, router):
         """
         For each of a router's VLANs, create an incoming VLAN vertex and
         outgoing VLAN vertex
         """
-        if (subgraph is None):
-            subgraph = self._vlan_sub
         for vlan in router.vlans.values():
-            self.add_vertex(name_prefix + self.vlan_name(vlan, "I"), 
-                    subgraph=subgraph)
-            self.add_vertex(name_prefix + self.vlan_name(vlan, "O"), 
-                    subgraph=subgraph)
+            self.add_vertex(self.vlan_name(vlan, "I"), subgraph=self._vlan_sub)
+            self.add_vertex(self.vlan_name(vlan, "O"), subgraph=self._vlan_sub)
 
-    def add_ospf_vertices(self, router, subgraph=None, name_prefix=""):
-        if (subgraph is None):
-            subgraph = self._ospf_sub
-        self.add_vertex(name_prefix + self.ospf_name(router), 
-                subgraph=subgraph)
+    def add_ospf_vertices(self, router):
+        self.add_vertex(self.ospf_name(router), subgraph=self._ospf_sub)
 
     def add_bgp_vertices(self, router):
         """
@@ -162,82 +182,92 @@ class TPG(graph.TPG):
         """
         for neighbor in router.bgp.neighbors:
             self.add_edge(self.bgp_name(router), self.bgp_name(neighbor),
-                    label=neighbor.import_policy)
+                    label=graph.Label.create(neighbor.import_policy,
+                            self._net))
 #            if (neighbor.import_policy is not None):
 #                print("%s->%s %s" % (self.bgp_name(router), 
 #                        self.bgp_name(neighbor), neighbor.import_policy))
 
-    def add_vlan_to_vlan_edges(self, router, name_prefix=""):
+    def add_vlan_to_vlan_edges(self, router):
         for vlan in router.vlans.values():
-            self.add_edge(name_prefix + self.vlan_name(vlan, "I"),
-                    name_prefix + self.vlan_name(vlan, "O"))
+            self.add_edge(self.vlan_name(vlan, "I"), self.vlan_name(vlan, "O"))
             for iface in vlan.ifaces:
-                self.add_edge(name_prefix + self.vlan_name(vlan, "O"),
-                        name_prefix + self.vlan_name(iface.neighbor.vlan, "I"))
+                self.add_edge(self.vlan_name(vlan, "O"),
+                        self.vlan_name(iface.neighbor.vlan, "I"))
 
-    def add_ospf_to_vlan_edges(self, router, name_prefix=""):
+    def add_ospf_to_vlan_edges(self, router):
         for vlan in router.ospf.active_vlans:
-            self.add_edge(name_prefix + self.ospf_name(router), 
-                    name_prefix + self.vlan_name(vlan, "O"), label={"cost":1})
+            self.add_edge(self.ospf_name(router), self.vlan_name(vlan, "O"),
+                    label=graph.Label(cost=1))
 
     def add_bgp_dependence_edges(self, router):
         """
         For each BGP neighbor, connect per-neighbor BGP vertex to VLAN vertex
-        (if neighbor is reachable via connected route) or OSPF vertex (if
-        neighbor is not reachable via connected route)
+        (if neighbor is reachable via connected route) or to the OSPF vertex
+        in the neighbor's next-hop replica of the IGP layer (if neighbor is
+        not reachable via connected route). A replica is only needed if the
+        router's BGP process may learn a route to the destination.
         """
         for neighbor in router.bgp.neighbors:
-            matching_vlan = None
-            for vlan in router.vlans.values():
-                if neighbor.addr in vlan.addr.network:
-                    matching_vlan = vlan
-                    break
+            matching_vlan = neighbor.connected_vlan
             if (matching_vlan):
                 self.add_edge(self.bgp_name(neighbor),
                         self.vlan_name(matching_vlan, "O"))
 #                        label=neighbor.import_policy)
-            elif (router.ospf is not None):
-                if (neighbor.iface not in self._nexthops):
-                    self.add_nexthop_subgraph(neighbor.iface)
-                name_prefix = self._nexthops[neighbor.iface].get_name()
+            elif (router.ospf is not None
+                    and self._rag.is_tainted(router.bgp, self._t)):
                 self.add_edge(self.bgp_name(neighbor),
-                        name_prefix + self.ospf_name(router))
+                        self.add_nexthop_entry(router, neighbor.iface))
 
-    def add_nexthop_subgraph(self, nexthop_iface):
+    def add_nexthop_entry(self, router, nexthop_iface):
+        """
+        Add the router's OSPF vertex in the next hop's replica of the IGP
+        layer, and return its name. The replica is not built: the vertex is
+        the replica's entry (see graph.Segment), whose paths through the
+        replica are found with the shared IGP layer's table, and whose only
+        out edge leads from the replica to the next hop's BGP vertex.
+        """
         name_prefix = "[%s:%s]" % (nexthop_iface.router.name, 
                 nexthop_iface.num)
-        nexthop_sub = self.add_subgraph(name_prefix, rank=None)
-        self._nexthops[nexthop_iface] = nexthop_sub
-
-        nexthop_ospf_sub = self.add_subgraph("%sospf" % (name_prefix), 
-                color="forestgreen", shape="box", supergraph=nexthop_sub)
-        nexthop_vlan_sub = self.add_subgraph("%svlan" % (name_prefix), 
-                color="blue", shape="box", supergraph=nexthop_sub)
-
-        for router in self._net.routers.values():
-            self.add_vlan_vertices(router, nexthop_vlan_sub, name_prefix)
-            if (router.ospf is not None):
-                self.add_ospf_vertices(router, nexthop_ospf_sub, name_prefix)
-        
-        for router in self._net.routers.values():
-            self.add_vlan_to_vlan_edges(router, name_prefix)
-            if (router.ospf is not None):
-                self.add_ospf_to_vlan_edges(router, name_prefix)
-                # add_vlan_to_ospf_edges
-                for vlan in router.vlans.values():
-                    self.add_edge(name_prefix + self.vlan_name(vlan, "I"), 
-                            name_prefix + self.ospf_name(router))
-
-        # Add edge to BGP
-        self.add_edge(name_prefix + self.vlan_name(nexthop_iface, "I"), 
-                    self.bgp_name(nexthop_iface.router))
-
-    def add_subnet_to_rib_edges(self, router):
-        if (self._s in router.subnets):
-            self.add_edge(self._s, self.rib_name(router))
+        name = name_prefix + self.ospf_name(router)
+        if (self.has_vertex(name)):
+            return name
+
+        if (nexthop_iface not in self._nexthops):
+            nexthop_sub = self.add_subgraph(name_prefix, rank=None)
+            self._nexthops[nexthop_iface] = self.add_subgraph(
+                    "%sospf" % (name_prefix), color="forestgreen", 
+                    shape="box", supergraph=nexthop_sub)
+
+        # The layer is only built once, and shared with the TPGs for other
+        # destinations if it was passed in
+        if (self._igp is None):
+            self._igp = IgpLayer(self._net)
+        igp = self._igp
+        entry = self.add_vertex(name, subgraph=self._nexthops[nexthop_iface])
+        # The exit leaves from the next hop's own VLAN, so it crosses no link
+        # of its own; the links it depends on are within the replica
+        exit = self.add_edge(name, self.bgp_name(nexthop_iface.router))
+        exit.link = None
+        self.add_segment(entry, igp.table, 
+                igp.get_vertex(self.ospf_name(router)),
+                igp.get_vertex(self.vlan_name(nexthop_iface, "I")), 
+                name_prefix)
+        return name
+
+    def add_source_edges(self, router, s):
+        self.add_edge(s, self.rib_name(router))
+
+    def prune_roots(self):
+        """
+        When a path is reprocessed (see graph.TPG.tpvp), the best paths of
+        the RIB vertices of the routers it traverses are queried too
+        """
+        return super().prune_roots() + [self.locate(self.rib_name(router))[0] 
+                for router in self._net.routers.values()]
 
     def add_rib_to_ospf_edges(self, router):
-        if (not self._rag.is_tainted(router.ospf)):
+        if (not self._rag.is_tainted(router.ospf, self._t)):
             return
         self.add_edge(self.rib_name(router), self.ospf_name(router))
 
@@ -248,7 +278,7 @@ class TPG(graph.TPG):
         connect all of the router's VLAN vertices to the "incoming" BGP vertex
         for the router
         """
-        if (not self._rag.is_tainted(router.bgp)):
+        if (not self._rag.is_tainted(router.bgp, self._t)):
             return
         self.add_edge(self.rib_name(router), self.bgp_name(router))
 
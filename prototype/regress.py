@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+
+from argparse import ArgumentParser
+import concurrent.futures
+import config
+import contextlib
+import difflib
+import glob
+import graph
+import io
+import multiprocessing
+import nsdi
+import os
+import redesign
+import subprocess
+import sys
+
+RULES = ["nsdi", "prensdi", "nsditpg", "prensdimod", "nsdimod", "redesign"]
+
+# Options that change how the driver computes its results, but not the
+# results themselves (-contract and -dijkstra may change which of several
+# paths TPVP chooses, so they are not checked)
+MODES = [['-worklist']]
+
+DRIVER = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+        'driver.py')
+
+def run(driver, json_path, rules, args, timeout):
+    """
+    Lines printed by a driver run, without its settings and the chains
+    printed by -contract
+    """
+    cmd = [sys.executable, driver, '-json', json_path, '-rules', rules] + args
+    try:
+        result = subprocess.run(cmd, stdout=subprocess.PIPE,
+                stderr=subprocess.STDOUT, universal_newlines=True,
+                timeout=timeout)
+    except subprocess.TimeoutExpired:
+        return ['Timed out after %d seconds' % timeout]
+    lines = []
+    for line in result.stdout.splitlines():
+        if (line.startswith('Settings:') or line.startswith('TPG ')
+                or (line.startswith('\t') and ' - ' in line)):
+            continue
+        lines.append(line)
+    # Only the exception of a failed run is compared, not where it was raised
+    if ('Traceback (most recent call last):' in lines):
+        del lines[lines.index('Traceback (most recent call last):'):-1]
+    if (result.returncode != 0):
+        lines.append('Exit status %d' % result.returncode)
+    return lines
+
+def compare(json_path, rules, args, settings):
+    """
+    Compare a run of the driver with each mode to a plain run, and check
+    sources attached after contraction (see check_late_sources), and return
+    the differences
+    """
+    name = os.path.basename(json_path)
+    plain = run(DRIVER, json_path, rules, args, settings.timeout)
+    others = [(' '.join(mode), DRIVER, args + mode) for mode in MODES]
+
+    diffs = []
+    for label, driver, other_args in others:
+        lines = run(driver, json_path, rules, other_args, settings.timeout)
+        if (lines != plain):
+            diffs.append("%s %s %s:\n%s" % (name, rules, label,
+                    '\n'.join(difflib.unified_diff(plain, lines, 'plain',
+                        label, lineterm=''))))
+
+    # TPVP does not converge for every network, so sources are only
+    # attached late if a plain run succeeds, and only for as long
+    failed = any([line.startswith('Timed out') or line.startswith('Exit')
+            for line in plain[-1:]])
+    if (rules in BASE_TPGS and not failed):
+        pool = multiprocessing.Pool(1)
+        try:
+            diffs += pool.apply_async(check_late_sources, 
+                    (json_path, rules)).get(settings.timeout)
+        except multiprocessing.TimeoutError:
+            diffs.append("%s %s late sources: timed out after %d seconds" %
+                    (name, rules, settings.timeout))
+        finally:
+            pool.terminate()
+    return diffs
+
+# Rules whose TPGs are built for a destination and several sources, to
+# which sources can be attached later (see graph.TPG.add_source)
+BASE_TPGS = {
+    "nsditpg" : lambda net, rag, pair: nsdi.TPG(net, pair, rag),
+    "nsdimod" : lambda net, rag, pair: nsdi.TPGMod(net, pair, rag),
+    "redesign" : lambda net, rag, pair: redesign.TPG(net, pair, rag),
+}
+
+def check_late_sources(json_path, rules):
+    """
+    Attach all but the first source to each destination's TPG after it is
+    contracted, and return the queries for which the contracted TPG does not
+    agree with the TPG as built about whether a source reaches the
+    destination (with no link or any one link failed), or returns a best
+    path that does not lead from the source to the destination
+    """
+    name = os.path.basename(json_path)
+    net = config.Network.load(json_path)
+    subnets = sorted(set([s for router in net.routers.values()
+            for s in router.subnets]))
+    rag_class = (redesign.RAG if rules == "redesign" else nsdi.RAG)
+    rag = rag_class(net, graph.Layer2(net), subnets)
+    rag.taint()
+
+    diffs = []
+    failsets = [frozenset()] + [frozenset([link]) for link in net.links]
+    for t in subnets:
+        sources = [s for s in subnets if s != t]
+        if (len(sources) < 2):
+            continue
+        built = BASE_TPGS[rules](net, rag, (t, sources))
+        contracted = BASE_TPGS[rules](net, rag, (t, sources[:1]))
+        with contextlib.redirect_stdout(io.StringIO()):
+            contracted.contract()
+        for s in sources[1:]:
+            contracted.add_source(s)
+
+        for s in sources:
+            for failset in failsets:
+                query = "%s %s late sources: %s to %s, failed [%s]" % (name,
+                        rules, s, t, ','.join(['-'.join(link) 
+                            for link in sorted(failset)]))
+                try:
+                    found, _ = contracted.has_path(failset, s)
+                    path, _ = contracted.tpvp(failset=failset, source=s)
+                except Exception as e:
+                    diffs.append("%s: %r" % (query, e))
+                    continue
+                if (found != built.has_path(failset, s)[0]):
+                    diffs.append("%s: has_path is %s" % (query, found))
+                elif (path is not None and (path[0] != s or path[-1] != t)):
+                    diffs.append("%s: best path is %s" % (query, 
+                            '>'.join(path)))
+    return diffs
+
+def main():
+    arg_parser = ArgumentParser(description='Check that the driver reports '
+            'the same paths in every mode, and that contracted TPGs agree '
+            'with the TPGs as built, on a set of networks')
+    arg_parser.add_argument('-networks', dest='networks', action='store',
+            nargs='+', metavar='JSON',
+            default=sorted(glob.glob(os.path.join(os.path.dirname(DRIVER),
+                '..', 'networks', '*.json'))),
+            help='Networks to check (default: all in networks/)')
+    arg_parser.add_argument('-rules', dest='rules', action='store',
+            nargs='+', choices=RULES, default=RULES,
+            help='Rules to check (default: all)')
+    arg_parser.add_argument('-failures', dest='failures', action='store',
+            type=int, metavar='K',
+            help='Also check paths under up to K link failures')
+    arg_parser.add_argument('-timeout', dest='timeout', action='store',
+            type=int, default=60, metavar='SECONDS',
+            help='Time allowed for each run')
+    arg_parser.add_argument('-jobs', dest='jobs', action='store', type=int,
+            default=1, metavar='N', help='Run N checks at a time')
+    settings = arg_parser.parse_args()
+
+    args = ['-paths']
+    if (settings.failures is not None):
+        args += ['-failures', str(settings.failures)]
+
+    checks = [(json_path, rules) for json_path in settings.networks
+            for rules in settings.rules]
+    with concurrent.futures.ThreadPoolExecutor(settings.jobs) as pool:
+        results = pool.map(lambda check: compare(check[0], check[1], args,
+                settings), checks)
+        diffs = [diff for result in results for diff in result]
+
+    for diff in diffs:
+        print(diff)
+    print("%d networks, %d rules: %d differences" %
+            (len(settings.networks), len(settings.rules), len(diffs)))
+    sys.exit(1 if len(diffs) > 0 else 0)
+
+if __name__ == '__main__':
+    main()
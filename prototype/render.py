@@ -0,0 +1,140 @@
+#!/usr/bin/python3
+
+import json
+import multiprocessing
+import os
+
+# Kinds of graphs that can be rendered
+KINDS = ["physical", "layer2", "ospf", "bgp", "combined", "rag", "rpg", "tpg",
+        "contract"]
+
+# Name of the file, in the render path, that records the digest of the graph
+# drawn to each image
+MANIFEST = "manifest.json"
+
+def draw(dot, file_path, prog):
+    import pygraphviz
+    agraph = pygraphviz.AGraph(string=dot)
+    agraph.draw(file_path, prog=prog)
+
+class Renderer:
+    """
+    Renders selected kinds of graphs to render_path. A graph is converted to
+    DOT when it is rendered, but laid out and drawn by a pool of background
+    processes (started by the first drawing), so analysis does not wait for
+    Graphviz. Graphs with more than max_size vertices are skipped, or laid
+    out with large_prog (e.g., sfdp) instead of dot. Without background
+    processes (jobs=0), graphs are drawn immediately. A collecting renderer
+    (e.g., in a worker process) only gathers its DOT strings, so another
+    renderer can draw them (see take and submit).
+
+    The digest of each drawn graph (see graph.Graph.digest) and layout
+    program is recorded in a manifest in render_path. A graph whose image
+    already exists with the same digest is neither converted nor drawn.
+    """
+    def __init__(self, render_path=None, kinds=KINDS, max_size=None,
+            large_prog=None, jobs=1, collect=False):
+        self._render_path = render_path
+        self._kinds = set(kinds)
+        self._max_size = max_size
+        self._large_prog = large_prog
+        self._collect = collect
+        self._jobs = jobs
+        self._pool = None
+        self._pending = []
+        self._results = []
+
+        self._manifest = {}
+        if (render_path is not None):
+            manifest_path = os.path.join(render_path, MANIFEST)
+            if (os.path.exists(manifest_path)):
+                with open(manifest_path, 'r') as manifest_file:
+                    self._manifest = json.load(manifest_file)
+
+    @classmethod
+    def create(cls, settings, collect=False):
+        return Renderer(settings.render_path,
+                (KINDS if settings.render_kinds is None
+                    else settings.render_kinds),
+                settings.render_max_size, settings.render_large_prog,
+                settings.render_jobs, collect)
+
+    def wants(self, kind):
+        return (self._render_path is not None and kind in self._kinds)
+
+    def render(self, g, kind, file_name):
+        if (not self.wants(kind)):
+            return
+
+        prog = 'dot'
+        if (self._max_size is not None
+                and len(g.vertices()) > self._max_size):
+            if (self._large_prog is None):
+                return
+            prog = self._large_prog
+
+        digest = "%s:%s" % (prog, g.digest())
+        if (self.is_current(file_name, digest)):
+            return
+
+        dot = g.to_agraph().string()
+        self.submit([(dot, file_name, prog, digest)])
+
+    def is_current(self, file_name, digest):
+        return (self._manifest.get(file_name) == digest
+                and os.path.exists(os.path.join(self._render_path, file_name)))
+
+    def submit(self, renders):
+        for dot, file_name, prog, digest in renders:
+            if (self._collect):
+                self._pending.append((dot, file_name, prog, digest))
+                continue
+
+            # A drawing that fails (or is interrupted) must not be recorded
+            self._manifest.pop(file_name, None)
+            args = (dot, os.path.join(self._render_path, file_name), prog)
+            # Processes are only started once there is something to draw
+            if (self._pool is None and self._jobs > 0):
+                self._pool = multiprocessing.Pool(self._jobs)
+            if (self._pool is None):
+                draw(*args)
+                self._manifest[file_name] = digest
+            else:
+                self._results.append((file_name, digest,
+                        self._pool.apply_async(draw, args)))
+
+    def take(self):
+        renders = self._pending
+        self._pending = []
+        return renders
+
+    def wait(self):
+        """
+        Wait for all renders to finish, save the manifest, and raise the
+        first error, if any
+        """
+        if (self._render_path is None or self._collect):
+            return
+
+        error = None
+        if (self._pool is not None):
+            self._pool.close()
+            self._pool.join()
+            for file_name, digest, result in self._results:
+                try:
+                    result.get()
+                    self._manifest[file_name] = digest
+                except Exception as e:
+                    if (error is None):
+                        error = e
+
+        # Replace the manifest atomically, so concurrent runs never read a
+        # partially written one
+        manifest_path = os.path.join(self._render_path, MANIFEST)
+        with open("%s.%d" % (manifest_path, os.getpid()), 'w') \
+                as manifest_file:
+            json.dump(self._manifest, manifest_file, indent=2, sort_keys=True)
+        os.replace(manifest_file.name, manifest_path)
+
+        if (error is not None):
+            raise error